@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2019, OSNEXUS Engineering (eng@osnexus.com)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+lookup: quantastor
+version_added: '4.6'
+short_description: Resolve QuantaStor object names to objects or object fields
+description:
+- Resolves one or more storage volume, storage pool, network share, host, host group, user or user group names (or IDs)
+  to the full object or to a single field of the object (eg. the volume 'id', the share 'exportPath', the host 'initiatorPortList').
+- All of the terms given to a single lookup are resolved from one enumeration of the requested object kind.
+- Enumerations are memoized in the worker process running the task, so repeated lookups of the same kind against the same
+  QuantaStor system within one task (eg. inside a template loop) do not issue additional REST calls. Other tasks enumerate again.
+author:
+- OSNEXUS Engineering
+options:
+  _terms:
+    description:
+    - Names or IDs of the objects to resolve.
+    required: true
+  kind:
+    description:
+    - The kind of object the terms refer to.
+    default: volume
+    choices: [ volume, pool, share, host, hostgroup, user, usergroup ]
+  field:
+    description:
+    - Name of the object field to return (eg. id, name, iqn, exportPath, freeSpace). If not given the whole object is returned as a dictionary.
+  on_missing:
+    description:
+    - Action to take when a term does not match any object.
+    default: error
+    choices: [ error, warn, skip ]
+  refresh:
+    description:
+    - Set to 'true' to discard the memoized enumeration and query the QuantaStor system again.
+    type: bool
+    default: false
+  quantastor_hostname:
+    description:
+    - Hostname or IP address of the QuantaStor system.
+    env:
+    - name: QS_HOSTNAME
+  quantastor_username:
+    description:
+    - QuantaStor username.
+    default: admin
+    env:
+    - name: QS_USERNAME
+  quantastor_password:
+    description:
+    - QuantaStor password.
+    default: password
+    env:
+    - name: QS_PASSWORD
+  quantastor_cert:
+    description:
+    - Path to the SSL certificate used to verify the QuantaStor REST service.
+    default: ''
+'''
+
+EXAMPLES = r'''
+- name: Show the ID of storage volume "volumeA"
+  debug:
+    msg: "{{ lookup('quantastor', 'volumeA', field='id', quantastor_hostname='10.10.10.2') }}"
+
+- name: Only run when the share "shareA" exists
+  debug:
+    msg: shareA exists
+  when: lookup('quantastor', 'shareA', kind='share', on_missing='skip', quantastor_hostname='10.10.10.2')
+
+- name: Template an fstab with the export paths of many shares (one REST call)
+  template:
+    src: fstab.j2
+    dest: /etc/fstab
+  vars:
+    share_paths: "{{ query('quantastor', *share_names, kind='share', field='exportPath', quantastor_hostname='10.10.10.2') }}"
+'''
+
+RETURN = r'''
+_raw:
+  description:
+  - One entry per resolved term, either the object as a dictionary or the requested field of the object.
+  type: list
+'''
+
+from ansible.errors import AnsibleError
+from ansible.plugins.lookup import LookupBase
+from ansible.utils.display import Display
+from ansible.module_utils.qs_client import QuantastorClient
+
+display = Display()
+
+# Maps a lookup 'kind' to the QuantastorClient enumeration method used to resolve it, and whether that method returns
+# a (task, list) pair rather than the list.
+ENUM_METHODS = {
+    'volume': ('storage_volume_enum', False),
+    'pool': ('storage_pool_enum', False),
+    'share': ('network_share_enum', True),
+    'host': ('host_enum', False),
+    'hostgroup': ('host_group_enum', True),
+    'user': ('user_enum', True),
+    'usergroup': ('user_group_enum', True),
+}
+
+# (hostname, username, kind) -> dict of name/id -> object dictionary, lives as long as the worker process of one task
+_ENUM_CACHE = {}
+
+
+def objectToDict(obj):
+    """Return the public fields of a qs_client object as a plain dictionary."""
+    return dict((key[1:], value) for key, value in vars(obj).items() if key.startswith('_'))
+
+
+class LookupModule(LookupBase):
+
+    def enumerate(self, kind):
+        cacheKey = (self.get_option('quantastor_hostname'), self.get_option('quantastor_username'), kind)
+        if self.get_option('refresh'):
+            _ENUM_CACHE.pop(cacheKey, None)
+        if cacheKey in _ENUM_CACHE:
+            return _ENUM_CACHE[cacheKey]
+
+        client = QuantastorClient(
+            hostname=self.get_option('quantastor_hostname'),
+            username=self.get_option('quantastor_username'),
+            password=self.get_option('quantastor_password'),
+            cert=self.get_option('quantastor_cert') or ''
+            )
+        method, returnsTask = ENUM_METHODS[kind]
+        try:
+            objList = getattr(client, method)()
+            if returnsTask:
+                task, objList = objList
+        except Exception as e:
+            raise AnsibleError("Failed to enumerate QuantaStor '%s' objects, error was '%s'." % (kind, str(e)))
+
+        index = {}
+        for obj in objList:
+            entry = objectToDict(obj)
+            index[entry.get('id')] = entry
+            index[entry.get('name')] = entry
+        _ENUM_CACHE[cacheKey] = index
+        return index
+
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+
+        kind = self.get_option('kind')
+        field = self.get_option('field')
+        onMissing = self.get_option('on_missing')
+        if kind not in ENUM_METHODS:
+            raise AnsibleError("Invalid kind '%s', must be one of: %s." % (kind, ', '.join(sorted(ENUM_METHODS))))
+        if not self.get_option('quantastor_hostname'):
+            raise AnsibleError("The 'quantastor_hostname' option (or QS_HOSTNAME environment variable) must be specified.")
+
+        index = self.enumerate(kind)
+
+        ret = []
+        for term in terms:
+            entry = index.get(term)
+            if entry is None:
+                if onMissing == 'error':
+                    raise AnsibleError("No QuantaStor %s named '%s' was found." % (kind, term))
+                elif onMissing == 'warn':
+                    display.warning("No QuantaStor %s named '%s' was found, skipping." % (kind, term))
+                continue
+            if field:
+                if field not in entry:
+                    raise AnsibleError("QuantaStor %s objects have no field named '%s'." % (kind, field))
+                ret.append(entry[field])
+            else:
+                ret.append(entry)
+        return ret
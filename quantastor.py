@@ -1,12 +1,19 @@
 # (c) 2019, OSNEXUS Corporation (eng@osnexus.com)
 # GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
 
+import errno
+import fcntl
+import fnmatch
+import hashlib
+import importlib.util
 import json
+import os
+import random
+import re
+import sys
+import threading
 import time
-from os import environ
-import requests
-from requests.auth import HTTPBasicAuth
-from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.basic import env_fallback
 
 def quantastor_argument_spec():
     """Return standard base dictionary used for the argument_spec argument in AnsibleModule"""
@@ -15,6 +22,889 @@ def quantastor_argument_spec():
         quantastor_hostname=dict(type = 'str'),
         quantastor_username=dict(type = 'str', default = 'admin'),
         quantastor_password=dict(type = 'str', default = 'password', no_log=True),
-        quantastor_cert=dict(type = 'str' , default = '')
+        quantastor_cert=dict(type = 'str' , default = ''),
+        quantastor_max_inflight=dict(type = 'int', default = 8, fallback = (env_fallback, ['QS_MAX_INFLIGHT'])),
+        quantastor_max_rps=dict(type = 'float', default = 0, fallback = (env_fallback, ['QS_MAX_RPS'])),
+        quantastor_state_dir=dict(type = 'path', default = '~/.ansible/qsansible', fallback = (env_fallback, ['QS_STATE_DIR'])),
+        quantastor_retries=dict(type = 'int', default = 3, fallback = (env_fallback, ['QS_RETRIES'])),
+        quantastor_retry_delay=dict(type = 'float', default = 1.0, fallback = (env_fallback, ['QS_RETRY_DELAY'])),
+        quantastor_breaker_threshold=dict(type = 'int', default = 5, fallback = (env_fallback, ['QS_BREAKER_THRESHOLD'])),
+        quantastor_breaker_cooldown=dict(type = 'float', default = 30.0, fallback = (env_fallback, ['QS_BREAKER_COOLDOWN'])),
+        quantastor_journal=dict(type = 'bool', default = False, fallback = (env_fallback, ['QS_JOURNAL'])),
+        quantastor_journal_ttl=dict(type = 'int', default = 300, fallback = (env_fallback, ['QS_JOURNAL_TTL']))
     )
 
+def quantastor_sdk_enabled():
+    """Return True if the QuantaStor python SDK is installed. The SDK is located without importing it."""
+
+    try:
+        return importlib.util.find_spec('ansible.module_utils.qs_client') is not None
+    except ImportError:
+        return False
+
+def quantastor_state_path(module, name):
+    """Return the path of a file in the controller-side state directory shared by all forks, creating the directory if needed"""
+
+    stateDir = os.path.expanduser(module.params['quantastor_state_dir'])
+    try:
+        os.makedirs(stateDir, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return os.path.join(stateDir, re.sub(r'[^A-Za-z0-9_.-]', '_', name))
+
+def quantastor_client(module, hostname=None, username=None, password=None, cert=None):
+    """Return a QuantastorClient for the module with all REST calls routed through the appliance's request governor,
+    retry policy and circuit breaker. The connection parameters default to the module's quantastor_* parameters."""
+
+    # qs_client is a large generated module that pulls in requests, so it is only imported once a client is needed rather
+    # than by every module start (argument errors, check mode and validation failures never pay for it)
+    from ansible.module_utils.qs_client import QuantastorClient
+    if hostname:
+        QuantastorClient._module = module
+        client = QuantastorClient(
+            hostname=hostname,
+            username=username or module.params['quantastor_username'],
+            password=password or module.params['quantastor_password'],
+            cert=cert if cert is not None else module.params['quantastor_cert'])
+    else:
+        client = QuantastorClient.from_module(module)
+    governor = QuantastorGovernor(
+        quantastor_state_path(module, 'governor-' + client._hostname),
+        maxInflight=module.params['quantastor_max_inflight'],
+        maxRps=module.params['quantastor_max_rps'])
+    breaker = None
+    if module.params['quantastor_breaker_threshold'] > 0:
+        breaker = QuantastorCircuitBreaker(
+            quantastor_state_path(module, 'breaker-' + client._hostname),
+            client._hostname,
+            threshold=module.params['quantastor_breaker_threshold'],
+            cooldown=module.params['quantastor_breaker_cooldown'])
+    retryPolicy = QuantastorRetryPolicy(
+        retries=module.params['quantastor_retries'],
+        delay=module.params['quantastor_retry_delay'],
+        breaker=breaker)
+    makeCall = client.make_call
+
+    def governedCall(api, payload):
+        return governor.call(makeCall, api, payload)
+
+    def retriedCall(api, payload):
+        return retryPolicy.call(governedCall, api, payload)
+
+    client.make_call = retriedCall
+    client.governor = governor
+    return client
+
+def quantastor_journal(module, client):
+    """Return the applied-state journal for the module's appliance, or None if the journal is not enabled"""
+
+    if not module.params['quantastor_journal']:
+        return None
+    return QuantastorJournal(
+        quantastor_state_path(module, 'journal-' + client._hostname + '.json'),
+        client,
+        module.params,
+        ttl=module.params['quantastor_journal_ttl'],
+        checkMode=module.check_mode)
+
+def quantastor_size_in_bytes(size, defaultMultiplier=1):
+    """Convert a size string such as '10GB', '512MiB' or '1024' to bytes. Sizes without a unit are multiplied by defaultMultiplier"""
+
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGTP]i?B?)?\s*$', str(size), re.IGNORECASE)
+    if not match:
+        raise ValueError("Invalid size '%s', expected a number optionally followed by KB, KiB, MB, MiB, GB, GiB, TB, TiB, PB or PiB." % size)
+    number, unit = match.groups()
+    if not unit:
+        return int(float(number) * defaultMultiplier)
+    unit = unit.upper()
+    exponent = 'KMGTP'.index(unit[0]) + 1
+    base = 1024 if 'I' in unit else 1000
+    return int(float(number) * base ** exponent)
+
+# Day names accepted in schedules, in bit order of the daysOfWeek mask
+SCHEDULE_DAYS = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+
+def quantastor_schedule_masks(hoursOfDay, daysOfWeek):
+    """Convert lists of hours (0-23) and days ('mon', 'tuesday' or 0-6 with 0 being Sunday) to the hoursOfDay/daysOfWeek bit masks"""
+
+    hoursMask = 0
+    for hour in hoursOfDay or []:
+        if not 0 <= int(hour) <= 23:
+            raise ValueError("Invalid hour '%s', hours must be between 0 and 23." % hour)
+        hoursMask |= 1 << int(hour)
+    daysMask = 0
+    for day in daysOfWeek or []:
+        if str(day).isdigit() and 0 <= int(day) <= 6:
+            daysMask |= 1 << int(day)
+        elif str(day).lower()[:3] in SCHEDULE_DAYS:
+            daysMask |= 1 << SCHEDULE_DAYS.index(str(day).lower()[:3])
+        else:
+            raise ValueError("Invalid day '%s', days must be day names or numbers between 0 (Sunday) and 6." % day)
+    return hoursMask, daysMask
+
+def quantastor_select_pool(module, client, name, candidates=None, size=0):
+    """Pick a storage pool for new volume or share 'name' from the cached pool list and the shared placement ledger"""
+
+    placer = QuantastorPoolPlacer(quantastor_state_path(module, 'pools-' + client._hostname + '.json'), client)
+    return placer.select(name, candidates, size)
+
+def quantastor_release_pool(module, client, name):
+    """Remove the placement of volume or share 'name' from the shared placement ledger after its create failed"""
+
+    placer = QuantastorPoolPlacer(quantastor_state_path(module, 'pools-' + client._hostname + '.json'), client)
+    placer.release(name)
+
+def quantastor_spread_offset(module, client, name, taken):
+    """Pick the start offset in minutes for schedule 'name' given the offsets of the appliance's other schedules"""
+
+    spreader = QuantastorOffsetSpreader(quantastor_state_path(module, 'offsets-' + client._hostname + '.json'))
+    return spreader.select(name, taken)
+
+def quantastor_directory(module, client):
+    """Return the names and IDs of the appliance's users and user groups as {'users': set, 'groups': set}, cached for all forks"""
+
+    cache = QuantastorDirectoryCache(quantastor_state_path(module, 'directory-' + client._hostname + '.json'), client)
+    return cache.get()
+
+def quantastor_host_registry(client):
+    """Return the registry of the appliance's hosts, host groups and initiator ports, loaded with one enumeration each"""
+
+    return QuantastorHostRegistry(client)
+
+def quantastor_port_key(port):
+    """Return the key initiator ports are compared by: IQNs compare case-insensitively and WWPNs also ignore ':' and '-'"""
+
+    key = port.strip().lower()
+    compact = key.replace(':', '').replace('-', '')
+    if len(compact) == 16 and all(c in '0123456789abcdef' for c in compact):
+        return compact
+    return key
+
+# HTTP status codes returned by an overloaded or restarting REST service
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Write APIs whose outcome can be checked after an ambiguous failure:
+# write api -> (get api, get api object parameter, write payload key holding the object name, True if the write creates the object)
+IDEMPOTENCY_CHECKS = {
+    'storageVolumeCreateEx': ('storageVolumeGet', 'storageVolume', 'name', True),
+    'storageVolumeDelete': ('storageVolumeGet', 'storageVolume', 'storageVolumeList', False),
+    'networkShareCreateEx': ('networkShareGet', 'networkShare', 'name', True),
+    'networkShareDeleteEx': ('networkShareGet', 'networkShare', 'networkShareList', False),
+    'hostAdd': ('hostGet', 'host', 'hostname', True),
+    'hostRemove': ('hostGet', 'host', 'host', False),
+    'hostGroupCreate': ('hostGroupGet', 'hostGroup', 'name', True),
+    'hostGroupDelete': ('hostGroupGet', 'hostGroup', 'hostGroup', False),
+    'replicationScheduleCreate': ('replicationScheduleGet', 'schedule', 'name', True),
+    'replicationScheduleDelete': ('replicationScheduleGet', 'schedule', 'schedule', False),
+    'snapshotScheduleCreate': ('snapshotScheduleGet', 'schedule', 'name', True),
+    'snapshotScheduleDelete': ('snapshotScheduleGet', 'schedule', 'schedule', False),
+    'userAdd': ('userGet', 'user', 'username', True),
+    'userRemove': ('userGet', 'user', 'user', False),
+    'userGroupCreate': ('userGroupGet', 'userGroup', 'name', True),
+    'userGroupDelete': ('userGroupGet', 'userGroup', 'userGroup', False),
+}
+
+def quantastor_is_read_api(api):
+    """Return True if the REST API only reads state and is therefore always safe to retry"""
+
+    return api.endswith('Get') or api.endswith('Enum')
+
+def quantastor_error_class(e):
+    """Classify an exception raised by QuantastorClient.make_call.
+
+    Returns 'connect' if the request never reached the appliance, 'transient' if it may have reached the appliance but
+    the failure is likely temporary, or None if the error is not retryable (eg. a RestError returned by the appliance).
+    """
+
+    import requests
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return 'connect'
+    if isinstance(e, requests.exceptions.ConnectionError):
+        if 'NewConnectionError' in str(e) or 'Connection refused' in str(e):
+            return 'connect'
+        return 'transient'
+    if isinstance(e, requests.exceptions.Timeout):
+        return 'transient'
+    match = re.search(r'status code = (\d+)', str(e))
+    if match and int(match.group(1)) in RETRYABLE_STATUS_CODES:
+        return 'transient'
+    return None
+
+
+class QuantastorCircuitOpenError(Exception):
+    pass
+
+
+class QuantastorCircuitBreaker(object):
+    """Fast-fails REST calls to an appliance after repeated transport failures, shared by all forks on the controller.
+
+    The breaker state lives in a flock()-protected JSON file. After 'threshold' consecutive failures the breaker opens
+    for 'cooldown' seconds; once the cooldown expires a single call is let through to probe the appliance.
+    """
+
+    def __init__(self, path, hostname, threshold=5, cooldown=30.0):
+        self._path = path
+        self._hostname = hostname
+        self._threshold = threshold
+        self._cooldown = cooldown
+
+    def before(self):
+        state = self._update(self._admit)
+        if state.get('rejected'):
+            raise QuantastorCircuitOpenError(
+                "QuantaStor system '%s' is unreachable after %d consecutive failures, failing fast until %s." %
+                (self._hostname, state['failures'], time.strftime('%H:%M:%S', time.localtime(state['openUntil']))))
+
+    def record(self, success):
+        self._update(self._succeed if success else self._fail)
+
+    def _admit(self, state):
+        now = time.time()
+        if state['openUntil'] > now:
+            state['rejected'] = True
+        elif state['openUntil']:
+            # half-open: let this call probe the appliance and keep everyone else out until it reports back
+            state['openUntil'] = now + self._cooldown
+        return state
+
+    def _succeed(self, state):
+        state['failures'] = 0
+        state['openUntil'] = 0
+        return state
+
+    def _fail(self, state):
+        state['failures'] += 1
+        if state['failures'] >= self._threshold:
+            state['openUntil'] = time.time() + self._cooldown
+        return state
+
+    def _update(self, change):
+        with open(self._path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            state = {'failures': 0, 'openUntil': 0}
+            try:
+                state.update(json.loads(f.read() or '{}'))
+            except ValueError:
+                pass
+            before = dict(state)
+            state = change(state)
+            rejected = state.pop('rejected', False)
+            if state != before:
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+            state['rejected'] = rejected
+            return state
+
+
+class QuantastorRetryPolicy(object):
+    """Retries failed REST calls with exponential backoff and jitter.
+
+    Read calls are retried on any retryable error. Write calls are retried when the request never reached the appliance,
+    or, after an ambiguous failure, when an IDEMPOTENCY_CHECKS probe shows that the write did not take effect.
+    """
+
+    def __init__(self, retries=3, delay=1.0, maxDelay=30.0, breaker=None):
+        self._retries = retries
+        self._delay = delay
+        self._maxDelay = maxDelay
+        self._breaker = breaker
+
+    def call(self, makeCall, api, payload):
+        attempt = 0
+        lastError = None
+        while True:
+            if self._breaker:
+                try:
+                    self._breaker.before()
+                except QuantastorCircuitOpenError as e:
+                    if lastError is None:
+                        raise
+                    # the breaker opened while this call was being retried; report why the call itself failed
+                    raise QuantastorCircuitOpenError("%s Last error was '%s'." % (str(e), str(lastError))) from lastError
+            try:
+                result = makeCall(api, payload)
+            except Exception as e:
+                errorClass = quantastor_error_class(e)
+                if self._breaker:
+                    self._breaker.record(errorClass is None)
+                if errorClass is None or attempt >= self._retries:
+                    raise
+                if errorClass == 'transient' and not quantastor_is_read_api(api):
+                    applied = self._checkApplied(makeCall, api, payload)
+                    if applied is None:
+                        raise
+                    if applied is not False:
+                        # the appliance answered the check, so it is reachable again
+                        if self._breaker:
+                            self._breaker.record(True)
+                        return applied
+                lastError = e
+                attempt += 1
+                time.sleep(self.backoff(attempt))
+                continue
+            if self._breaker:
+                self._breaker.record(True)
+            return result
+
+    def backoff(self, attempt):
+        ceiling = min(self._maxDelay, self._delay * (2 ** (attempt - 1)))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def _checkApplied(self, makeCall, api, payload):
+        """Return False if the write did not take effect, a substitute response if it did, or None if unknown"""
+
+        if api not in IDEMPOTENCY_CHECKS:
+            return None
+        getApi, getParam, nameKey, creates = IDEMPOTENCY_CHECKS[api]
+        name = payload.get(nameKey)
+        if not name or ',' in str(name):
+            return None
+        try:
+            obj = makeCall(getApi, {getParam: name, 'flags': '0'})
+            exists = True
+        except Exception as e:
+            if quantastor_error_class(e) is not None:
+                return None
+            obj = {}
+            exists = False
+        if exists != creates:
+            return False
+        return {'task': {}, 'obj': obj}
+
+
+class QuantastorGovernor(object):
+    """Limits the in-flight REST requests and request rate to one QuantaStor appliance across all forks on the controller.
+
+    In-flight requests are bounded by a fixed set of slot files that are held with flock() for the duration of a request.
+    Waiters pass one at a time through a queue lock before claiming a slot, which keeps the ordering fair, and the holder of
+    the queue lock also paces the request rate. Time spent waiting is accumulated in '<prefix>.stats'.
+    """
+
+    POLL_INTERVAL = 0.02
+
+    def __init__(self, prefix, maxInflight=8, maxRps=0):
+        self._prefix = prefix
+        self._maxInflight = maxInflight
+        self._maxRps = maxRps
+        self.requests = 0
+        self.waitSeconds = 0.0
+
+    def call(self, func, *args):
+        if self._maxInflight <= 0 and self._maxRps <= 0:
+            return func(*args)
+        slot = self.acquire()
+        try:
+            return func(*args)
+        finally:
+            self.release(slot)
+
+    def acquire(self):
+        start = time.time()
+        queue = open(self._prefix + '.queue', 'a')
+        try:
+            fcntl.flock(queue, fcntl.LOCK_EX)
+            slot = None
+            while self._maxInflight > 0:
+                slot = self._claimSlot()
+                if slot is not None:
+                    break
+                time.sleep(self.POLL_INTERVAL)
+            if self._maxRps > 0:
+                self._pace()
+            waited = time.time() - start
+            self.requests += 1
+            self.waitSeconds += waited
+            self._recordStats(waited)
+        finally:
+            queue.close()
+        return slot
+
+    def release(self, slot):
+        if slot is not None:
+            slot.close()
+
+    def _claimSlot(self):
+        for i in range(self._maxInflight):
+            slot = open('%s.slot.%d' % (self._prefix, i), 'a')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except (IOError, OSError) as e:
+                slot.close()
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+        return None
+
+    def _pace(self):
+        # '<prefix>.rate' holds the earliest time at which the next request may be sent
+        nextAllowed = 0.0
+        try:
+            with open(self._prefix + '.rate') as f:
+                nextAllowed = float(f.read() or 0)
+        except (IOError, OSError, ValueError):
+            pass
+        now = time.time()
+        if nextAllowed > now:
+            time.sleep(nextAllowed - now)
+            now = nextAllowed
+        with open(self._prefix + '.rate', 'w') as f:
+            f.write(repr(now + 1.0 / self._maxRps))
+
+    def _recordStats(self, waited):
+        stats = {'requests': 0, 'waitSeconds': 0.0, 'maxWaitSeconds': 0.0}
+        try:
+            with open(self._prefix + '.stats') as f:
+                stats.update(json.load(f))
+        except (IOError, OSError, ValueError):
+            pass
+        stats['requests'] += 1
+        stats['waitSeconds'] += waited
+        stats['maxWaitSeconds'] = max(stats['maxWaitSeconds'], waited)
+        with open(self._prefix + '.stats', 'w') as f:
+            json.dump(stats, f)
+
+
+class QuantastorJournal(object):
+    """Local record of the last-applied spec of each object, used to skip REST calls on no-op runs.
+
+    For each object the journal keeps a hash of the module parameters last applied to it and the object's
+    modifiedTimeStamp on the appliance (None if the object was deleted). An object is current when the hash matches
+    and a bulk snapshot of modification stamps, taken with one enumeration per object kind and reused by all tasks for
+    'ttl' seconds, still shows the recorded stamp. Changes made on the appliance are therefore noticed within 'ttl' seconds.
+    In check mode nothing is recorded, so that a dry run never marks a change as applied.
+    """
+
+    # journal kind -> (QuantastorClient enumeration method used for the bulk modification stamp snapshot,
+    #                  True if the enumeration returns a (task, list) pair rather than the list)
+    ENUM_METHODS = {
+        'volume': ('storage_volume_enum', False),
+        'share': ('network_share_enum', True),
+        'host': ('host_enum', False),
+        'hostgroup': ('host_group_enum', True),
+    }
+
+    # journal kind -> (QuantastorClient get method, object parameter name)
+    GET_METHODS = {
+        'volume': ('storage_volume_get', 'storageVolume'),
+        'share': ('network_share_get', 'networkShare'),
+        'host': ('host_get', 'host'),
+        'hostgroup': ('host_group_get', 'hostGroup'),
+    }
+
+    def __init__(self, path, client, params, ttl=300, checkMode=False):
+        self._path = path
+        self._client = client
+        self._ttl = ttl
+        self._checkMode = checkMode
+        spec = dict((key, value) for key, value in params.items() if not key.startswith('quantastor_'))
+        self.specHash = hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def is_current(self, kind, name):
+        """Return True if the module parameters were already applied to the object and it has not changed since"""
+
+        if not name:
+            return False
+        entry = self._update(lambda journal: journal['objects'].get(kind + ':' + name))
+        if not entry or entry['hash'] != self.specHash:
+            return False
+        stamps = self._snapshot(kind)
+        return stamps is not None and stamps.get(name) == entry['stamp']
+
+    def record(self, kind, name, obj):
+        """Record that the module parameters were applied to the object (a qs_client object, or None if it was deleted)"""
+
+        if not name or self._checkMode:
+            return
+        stamp = obj._modifiedTimeStamp if obj is not None else None
+        def change(journal):
+            journal['objects'][kind + ':' + name] = {'hash': self.specHash, 'stamp': stamp}
+            snapshot = journal['snapshots'].get(kind)
+            if snapshot:
+                if stamp is None:
+                    snapshot['stamps'].pop(name, None)
+                else:
+                    snapshot['stamps'][name] = stamp
+            return journal
+        self._update(change, write=True)
+
+    def refresh(self, kind, name):
+        """Fetch the object from the appliance after a change and record it"""
+
+        if self._checkMode:
+            return
+        try:
+            obj = getattr(self._client, self.GET_METHODS[kind][0])(**{self.GET_METHODS[kind][1]: name})
+        except Exception as e:
+            if quantastor_error_class(e) is not None:
+                return
+            obj = None
+        if isinstance(obj, tuple):
+            # some get calls return a (task, object) pair
+            obj = obj[-1]
+        self.record(kind, name, obj)
+
+    def _snapshot(self, kind):
+        snapshot = self._update(lambda journal: journal['snapshots'].get(kind))
+        if snapshot and time.time() - snapshot['time'] < self._ttl:
+            return snapshot['stamps']
+        method, returnsTask = self.ENUM_METHODS[kind]
+        try:
+            objList = getattr(self._client, method)()
+            if returnsTask:
+                task, objList = objList
+            snapshot = {'time': time.time(), 'stamps': dict((obj._name, obj._modifiedTimeStamp) for obj in objList)}
+        except Exception:
+            return None
+        def change(journal):
+            journal['snapshots'][kind] = snapshot
+            return journal
+        self._update(change, write=True)
+        return snapshot['stamps']
+
+    def _update(self, change, write=False):
+        with open(self._path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            f.seek(0)
+            journal = {'objects': {}, 'snapshots': {}}
+            try:
+                journal.update(json.loads(f.read() or '{}'))
+            except ValueError:
+                pass
+            result = change(journal)
+            if write:
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(journal))
+            return result
+
+
+class QuantastorPoolPlacer(object):
+    """Chooses storage pools for new volumes and shares so that consecutive placements spread across pools and nodes.
+
+    Pool capacity is enumerated at most once every POOL_CACHE_TTL seconds and cached in a flock()-protected file together
+    with a ledger of recent placements made by any fork. Each pool is scored by its projected free space fraction after
+    the placements made since the pool list was taken, divided by one plus the number of recent placements on the pool
+    (and SYSTEM_WEIGHT times those on the pool's storage system). A batch of creates is therefore shared out between the
+    pools in proportion to their free space instead of piling onto the emptiest pool, however small the objects are.
+    """
+
+    POOL_CACHE_TTL = 60
+    LEDGER_WINDOW = 600
+    SYSTEM_WEIGHT = 0.25
+
+    def __init__(self, path, client):
+        self._path = path
+        self._client = client
+
+    def select(self, name, candidates=None, size=0):
+        """Return the name of the chosen pool and record the placement of 'name'; raise an Exception if no pool qualifies"""
+
+        with open(self._path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            cache = {'time': 0, 'pools': [], 'placements': []}
+            try:
+                cache.update(json.loads(f.read() or '{}'))
+            except ValueError:
+                pass
+
+            now = time.time()
+            if now - cache['time'] >= self.POOL_CACHE_TTL:
+                cache['pools'] = [self._poolInfo(pool) for pool in self._client.storage_pool_enum()]
+                cache['time'] = now
+            cache['placements'] = [p for p in cache['placements'] if now - p['time'] < self.LEDGER_WINDOW]
+
+            best = None
+            bestScore = None
+            for pool in cache['pools']:
+                if not pool['usable']:
+                    continue
+                if candidates and not any(fnmatch.fnmatch(pool['name'], c) or pool['id'] == c for c in candidates):
+                    continue
+                pending = sum(p['size'] for p in cache['placements'] if p['poolId'] == pool['id'] and p['time'] >= cache['time'])
+                free = pool['freeSpace'] - pending
+                if free < size or pool['size'] <= 0:
+                    continue
+                placed = sum(1 for p in cache['placements'] if p['poolId'] == pool['id'])
+                placed += self.SYSTEM_WEIGHT * sum(1 for p in cache['placements'] if p['systemId'] == pool['systemId'])
+                score = float(free) / pool['size'] / (1 + placed)
+                if bestScore is None or score > bestScore:
+                    best, bestScore = pool, score
+
+            if best is None:
+                raise Exception("No storage pool%s has %d bytes of free space available." %
+                                (" matching '%s'" % ','.join(candidates) if candidates else '', size))
+
+            cache['placements'].append({'name': name, 'poolId': best['id'], 'systemId': best['systemId'], 'size': size, 'time': now})
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(cache))
+            return best['name']
+
+    def release(self, name):
+        """Remove the placement recorded for 'name' so that a failed create neither reserves space nor counts against the pool"""
+
+        with open(self._path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                cache = json.loads(f.read() or '{}')
+            except ValueError:
+                return
+            placements = cache.get('placements', [])
+            cache['placements'] = [p for p in placements if p.get('name') != name]
+            if len(cache['placements']) == len(placements):
+                return
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(cache))
+
+    def _poolInfo(self, pool):
+        def number(value):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return 0
+        return {
+            'id': pool._id,
+            'name': pool._name,
+            'systemId': pool._storageSystemId,
+            'size': number(pool._size),
+            'freeSpace': number(pool._freeSpace),
+            'usable': bool(pool._isActive) and not pool._isDegraded and not pool._markedDisabled,
+        }
+
+
+class QuantastorOffsetSpreader(object):
+    """Chooses start offsets for schedules so that schedules of one appliance do not all fire in the same minute.
+
+    The offset used by the fewest schedules is chosen, counting both the schedules on the appliance and the offsets handed
+    out by any fork during the last LEDGER_WINDOW seconds, which are recorded in a flock()-protected file. Ties are broken
+    by a hash of the schedule name so that the choice is stable and concurrent forks start from different minutes.
+    """
+
+    LEDGER_WINDOW = 600
+    PERIOD = 60
+
+    def __init__(self, path):
+        self._path = path
+
+    def select(self, name, taken):
+        """Return the chosen offset for schedule 'name' and record it; 'taken' lists the offsets of the other schedules"""
+
+        with open(self._path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            ledger = {'claims': []}
+            try:
+                ledger.update(json.loads(f.read() or '{}'))
+            except ValueError:
+                pass
+
+            now = time.time()
+            ledger['claims'] = [c for c in ledger['claims'] if now - c['time'] < self.LEDGER_WINDOW and c['name'] != name]
+            counts = [0] * self.PERIOD
+            for offset in list(taken) + [c['offset'] for c in ledger['claims']]:
+                counts[int(offset) % self.PERIOD] += 1
+
+            first = int(hashlib.sha1(name.encode('utf-8')).hexdigest(), 16) % self.PERIOD
+            order = [(first + i) % self.PERIOD for i in range(self.PERIOD)]
+            offset = min(order, key=lambda minute: counts[minute])
+
+            ledger['claims'].append({'name': name, 'offset': offset, 'time': now})
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(ledger))
+            return offset
+
+
+class QuantastorDirectoryCache(object):
+    """Caches the user and user group names of an appliance in a flock()-protected file for DIRECTORY_CACHE_TTL seconds,
+    so that validating the owners and access lists of a batch of shares costs one enumeration of each rather than one per share.
+    """
+
+    DIRECTORY_CACHE_TTL = 60
+
+    def __init__(self, path, client):
+        self._path = path
+        self._client = client
+
+    def get(self):
+        with open(self._path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            cache = {'time': 0, 'users': [], 'groups': []}
+            try:
+                cache.update(json.loads(f.read() or '{}'))
+            except ValueError:
+                pass
+
+            now = time.time()
+            if now - cache['time'] >= self.DIRECTORY_CACHE_TTL:
+                task, users = self._client.user_enum()
+                task, groups = self._client.user_group_enum()
+                cache['users'] = [name for user in users for name in (user._name, user._id)]
+                cache['groups'] = [name for group in groups for name in (group._name, group._id)]
+                cache['time'] = now
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(cache))
+            return {'users': set(cache['users']), 'groups': set(cache['groups'])}
+
+
+
+class QuantastorHostRecord(object):
+    """Compact record of a host: its ID, name, host group ID and the names of its initiator ports"""
+
+    __slots__ = ('id', 'name', 'groupId', 'ports')
+
+    def __init__(self, id, name, groupId, ports):
+        self.id = id
+        self.name = name
+        self.groupId = groupId
+        self.ports = ports
+
+    @classmethod
+    def from_host(cls, host):
+        """Build the record of a qs_client Host object, or of a host as returned by the hostEnum REST call"""
+
+        if isinstance(host, dict):
+            id, name, groupId, portList = host.get('id', ''), host.get('name', ''), host.get('hostGroupId', ''), host.get('initiatorPortList')
+        else:
+            id, name, groupId, portList = host._id, host._name, host._hostGroupId, host._initiatorPortList
+        ports = tuple(sys.intern(port['name']) for port in portList or [] if port.get('name'))
+        return cls(sys.intern(id), sys.intern(name), sys.intern(groupId or ''), ports)
+
+    def missing(self, ports):
+        """Return the given ports the host does not have, in the given order and without duplicates"""
+
+        keys = set(quantastor_port_key(port) for port in self.ports)
+        result = []
+        for port in ports:
+            key = quantastor_port_key(port)
+            if key not in keys:
+                keys.add(key)
+                result.append(port)
+        return result
+
+    def held(self, ports):
+        """Return the host's own names of the given ports it has, in the given order"""
+
+        names = dict((quantastor_port_key(port), port) for port in self.ports)
+        result = []
+        for port in ports:
+            name = names.pop(quantastor_port_key(port), None)
+            if name is not None:
+                result.append(name)
+        return result
+
+
+class QuantastorHostGroupRecord(object):
+    """Compact record of a host group: its ID, name and the IDs of its hosts"""
+
+    __slots__ = ('id', 'name', 'hostIds')
+
+    def __init__(self, id, name, hostIds):
+        self.id = id
+        self.name = name
+        self.hostIds = hostIds
+
+
+class QuantastorHostRegistry(object):
+    """All hosts, host groups and initiator ports of an appliance, loaded with one enumeration each.
+
+    Hosts and groups are kept as __slots__ records with interned strings and indexed by ID and name, and every initiator
+    port is indexed to the host holding it, so checking thousands of ports against tens of thousands of ports held by other
+    hosts costs one hash lookup per port. The enumerations are read as raw JSON rather than as qs_client objects, and host
+    groups are only enumerated when first needed.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._hosts = {}
+        self._portOwners = {}
+        self._groups = None
+        self._lock = threading.Lock()
+        for host in client.make_call('hostEnum', {'flags': '0'}):
+            record = QuantastorHostRecord.from_host(host)
+            self._hosts[record.id] = record
+            self._hosts[record.name] = record
+            for port in record.ports:
+                self._portOwners[sys.intern(quantastor_port_key(port))] = record
+
+    def host(self, key):
+        """Return the record of the host with the given name or ID, or None"""
+
+        return self._hosts.get(key)
+
+    def owner(self, port):
+        """Return the record of the host holding the initiator port, or None"""
+
+        return self._portOwners.get(quantastor_port_key(port))
+
+    def owners(self, ports):
+        """Return {port: host name or None} for a list of initiator ports"""
+
+        return dict((port, getattr(self.owner(port), 'name', None)) for port in ports)
+
+    def conflicts(self, ports, host=None):
+        """Return {port: host name} for the given ports that are held by a host other than 'host' (a name or ID)"""
+
+        record = self.host(host) if host else None
+        result = {}
+        for port in ports:
+            owner = self.owner(port)
+            if owner is not None and owner is not record:
+                result[port] = owner.name
+        return result
+
+    def reserve(self, name, ports):
+        """Index a host about to be created with the given ports unless one of them is held by another host.
+
+        Returns the conflicts as {port: host name}; the host is only indexed if there are none. Checking and indexing is
+        atomic, so of two hosts created concurrently or one after the other with the same port only the first passes.
+        """
+
+        with self._lock:
+            conflicts = self.conflicts(ports, name)
+            if not conflicts and self.host(name) is None:
+                record = QuantastorHostRecord('', sys.intern(name), '', tuple(sys.intern(port) for port in ports))
+                self._hosts[record.name] = record
+                for port in ports:
+                    self._portOwners[sys.intern(quantastor_port_key(port))] = record
+            return conflicts
+
+    def group(self, key):
+        """Return the record of the host group with the given name or ID, or None"""
+
+        return self._loadGroups().get(key)
+
+    def groups_of(self, host):
+        """Return the records of the host groups containing the host with the given name or ID"""
+
+        record = self.host(host)
+        if record is None:
+            return []
+        groups = dict((group.id, group) for group in self._loadGroups().values() if record.id in group.hostIds)
+        if record.groupId in self._groups:
+            groups[record.groupId] = self._groups[record.groupId]
+        return list(groups.values())
+
+    def _loadGroups(self):
+        # filled in a local dict first so that threads sharing the registry never see a partly loaded index
+        if self._groups is None:
+            groups = {}
+            for group in self._client.make_call('hostGroupEnum', {'flags': '0'}).get('list', []):
+                hostIds = []
+                for host in group.get('hostList') or []:
+                    key = (host.get('id') or host.get('name')) if isinstance(host, dict) else host
+                    record = self.host(key)
+                    hostIds.append(record.id if record else sys.intern(key))
+                record = QuantastorHostGroupRecord(sys.intern(group.get('id', '')), sys.intern(group.get('name', '')), frozenset(hostIds))
+                groups[record.id] = record
+                groups[record.name] = record
+            self._groups = groups
+        return self._groups
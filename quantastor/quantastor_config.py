@@ -0,0 +1,516 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2019, OSNEXUS Engineering (eng@osnexus.com)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+module: quantastor_config
+version_added: '4.6'
+short_description: Export the logical configuration of a QuantaStor storage grid to a file and import it into another grid
+description:
+- With 'action: export' the QoS policies, storage volumes, network shares (with their quota, reservation and tuning settings,
+  owner, SMB options and user access list and NFS client access entries), hosts with their initiators, host groups and volume assignments (ACLs) are written to a gzip compressed JSON lines file, one
+  object per line, as they are read from the appliance.
+- With 'action: import' the file is read line by line and the objects are created in dependency order (QoS policies, volumes,
+  shares, hosts, host groups, then assignments). Objects of one kind are created in batches of 'batchSize' with up to
+  'concurrency' creates at the same time, and objects which already exist are left alone.
+- After every completed batch the position in the file is saved to a checkpoint file. If an import fails it stops after the
+  current batch and a later run with the same file continues from the checkpoint instead of from the start. The checkpoint is
+  removed once the import completed.
+- Snapshots, sub-shares and the data of volumes and shares are not exported. Storage pools must exist on the importing grid,
+  see 'poolMap'.
+author:
+- OSNEXUS Engineering
+options:
+  action:
+    description:
+    - Export the configuration of the grid to 'path' or import the configuration in 'path' into the grid.
+    required: true
+    choices: [ export, import ]
+  path:
+    description:
+    - Path of the gzip compressed JSON lines configuration file.
+    required: true
+  kinds:
+    description:
+    - Kinds of objects to export or import. Defaults to all kinds.
+    choices: [ qospolicy, volume, share, host, hostgroup, acl ]
+  poolMap:
+    description:
+    - Dictionary mapping the names of storage pools in the file to the names or IDs of the pools to create the volumes and shares
+      in on import. Pools that are not mapped are looked up by their name.
+  checkpoint:
+    description:
+    - Path of the checkpoint file of an import. Defaults to 'path' with '.checkpoint' appended.
+  resume:
+    description:
+    - Continue an import from its checkpoint. With 'false' an existing checkpoint is ignored and the import starts from the
+      beginning of the file (objects created before are still left alone).
+    type: bool
+    default: true
+  batchSize:
+    description:
+    - Number of objects created per batch on import. A checkpoint is saved after every batch.
+    default: 100
+  concurrency:
+    description:
+    - Maximum number of REST calls made at the same time on import.
+    default: 8
+  flags:
+    description:
+    - Optional flags for the operation.
+extends_documentation_fragment:
+- quantastor
+'''
+
+EXAMPLES = r'''
+- name: Export the configuration of the production grid
+  quantastor_config:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    action: export
+    path: /var/backups/qs-prod.jsonl.gz
+
+- name: Rebuild it on the DR grid, re-run to continue after a failure
+  quantastor_config:
+    quantastor_hostname: 10.20.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    action: import
+    path: /var/backups/qs-prod.jsonl.gz
+    poolMap:
+      pool-ssd: dr-pool-ssd
+      pool-hdd: dr-pool-hdd
+'''
+
+RETURN = r'''
+counts:
+  description: Number of objects per kind that were exported, or that were created or found to exist already on import.
+  returned: always
+  type: dict
+  sample: {"volume": {"created": 120, "existing": 3}, "host": {"created": 40, "existing": 0}}
+resumedAt:
+  description: Line of the file the import continued from, 0 if it started at the beginning.
+  returned: on import
+  type: int
+'''
+
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.quantastor import (quantastor_argument_spec, quantastor_client, quantastor_host_registry,
+    quantastor_sdk_enabled)
+
+FORMAT_VERSION = 1
+
+# Kinds of objects in the order they depend on each other and are written and created in
+KINDS = ['qospolicy', 'volume', 'share', 'host', 'hostgroup', 'acl']
+
+# storageVolumeCreateEx parameter -> StorageVolume attribute
+VOLUME_SETTINGS = {
+    'description': '_description',
+    'size': '_size',
+    'blockSizeKb': '_blockSizeKb',
+    'stripeSizeKb': '_stripeSizeKb',
+    'stripeCount': '_stripeCount',
+    'accessMode': '_accessMode',
+    'chapPolicy': '_chapPolicy',
+    'syncPolicy': '_syncPolicy',
+    'compressionType': '_compressionType',
+    'copies': '_copies',
+    'spaceReserved': '_spaceReserved',
+    'cachePolicyPrimary': '_cachePolicyPrimary',
+    'cachePolicySecondary': '_cachePolicySecondary',
+}
+
+# networkShareCreateEx parameter -> NetworkShare attribute
+SHARE_SETTINGS = {
+    'description': '_description',
+    'isActive': '_isActive',
+    'enableCifs': '_enableCifs',
+    'permissions': '_permissions',
+    'spaceQuota': '_spaceQuota',
+    'spaceQuotaExcludeSnapshots': '_spaceQuotaExcludeSnapshots',
+    'spaceReserved': '_spaceReserved',
+    'blockSizeKb': '_blockSizeKb',
+    'syncPolicy': '_syncPolicy',
+    'compressionType': '_compressionType',
+    'copies': '_copies',
+    'cachePolicyPrimary': '_cachePolicyPrimary',
+    'cachePolicySecondary': '_cachePolicySecondary',
+    'disableSnapBrowsing': '_disableSnapBrowsing',
+    'disableSmbSnapsDir': '_disableSmbSnapsDir',
+    'disableNfsSnapsDir': '_disableNfsSnapsDir',
+    'enableNfsSnapBrowsing': '_enableNfsSnapBrowsing',
+    'nfsSecurityPolicy': '_nfsSecurityPolicy',
+    'smallBlockThreshold': '_smallBlockThreshold',
+    'shareOwner': '_ownerUid',
+    'shareOwnerGroup': '_ownerGid',
+    'cifsOptions': '_cifsOptionList',
+    'userAccessList': '_cifsUserAccessList',
+}
+
+# networkShareClientAdd parameter -> NetworkShareClient attribute
+SHARE_CLIENT_SETTINGS = {
+    'clientFilter': '_clientFilter',
+    'readOnly': '_readOnly',
+    'secure': '_secure',
+    'isAsync': '_async',
+    'subtreeCheck': '_subtreeCheck',
+    'customOptions': '_customOptions',
+}
+
+# NFS client filter of the access entry that networkShareCreateEx adds for a public share
+PUBLIC_CLIENT_FILTER = '*'
+
+QOS_LIMITS = ['qosReadIops', 'qosWriteIops', 'qosReadBandwidth', 'qosWriteBandwidth']
+
+
+def settings(obj, attrs):
+    return dict((param, getattr(obj, attr)) for param, attr in attrs.items())
+
+
+def exportRecords(client, kinds):
+    """Yield the records of the grid's configuration one at a time, in dependency order"""
+
+    pools = dict((pool._id, pool._name) for pool in client.storage_pool_enum())
+    policies = {}
+    volumes = {}
+    hosts = {}
+    groups = {}
+    if 'qospolicy' in kinds or 'volume' in kinds:
+        for policy in client.qos_policy_enum():
+            policies[policy._id] = policy._name
+            if 'qospolicy' in kinds:
+                yield dict(kind='qospolicy', name=policy._name, settings=dict(settings(policy, dict((limit, '_' + limit) for limit in QOS_LIMITS)),
+                                                                              description=policy._description))
+    if 'volume' in kinds or 'acl' in kinds:
+        for volume in client.storage_volume_enum():
+            if volume._isSnapshot:
+                continue
+            volumes[volume._id] = volume._name
+            if 'volume' in kinds:
+                record = dict(kind='volume', name=volume._name, pool=pools.get(volume._storagePoolId, volume._storagePoolId),
+                              settings=settings(volume, VOLUME_SETTINGS), qos=dict((limit, getattr(volume, '_' + limit)) for limit in QOS_LIMITS))
+                record['qos']['qosPolicy'] = policies.get(volume._qosPolicyId, '')
+                yield record
+    if 'share' in kinds:
+        shareClients = {}
+        for shareClient in client.network_share_client_enum():
+            shareClients.setdefault(shareClient._networkShareId, []).append(settings(shareClient, SHARE_CLIENT_SETTINGS))
+        task, shares = client.network_share_enum()
+        for share in shares:
+            if share._isSnapshot or share._parentShareId:
+                continue
+            nfsClients = shareClients.pop(share._id, [])
+            record = dict(kind='share', name=share._name, pool=pools.get(share._storagePoolId, share._storagePoolId), settings=settings(share, SHARE_SETTINGS),
+                          nfsClients=nfsClients)
+            record['settings']['isPublic'] = bool(getattr(share, '_isPublic', False)) or any(c['clientFilter'] == PUBLIC_CLIENT_FILTER for c in nfsClients)
+            yield record
+        del shares, shareClients
+    if 'host' in kinds or 'hostgroup' in kinds or 'acl' in kinds:
+        for host in client.host_enum():
+            hosts[host._id] = host._name
+            if 'host' in kinds:
+                yield dict(kind='host', name=host._name, description=host._description,
+                           initiators=[port['name'] for port in host._initiatorPortList or [] if port.get('name')])
+    if 'hostgroup' in kinds or 'acl' in kinds:
+        task, hostGroups = client.host_group_enum()
+        for group in hostGroups:
+            groups[group._id] = group._name
+            if 'hostgroup' in kinds:
+                members = [(host.get('id') or host.get('name')) if isinstance(host, dict) else host for host in group._hostList or []]
+                yield dict(kind='hostgroup', name=group._name, description=group._description, hosts=[hosts.get(member, member) for member in members])
+    if 'acl' in kinds:
+        for acl in client.storage_volume_acl_enum():
+            if acl._storageVolumeId in volumes and (acl._hostId in hosts or acl._hostId in groups):
+                yield dict(kind='acl', volume=volumes[acl._storageVolumeId], host=hosts.get(acl._hostId) or groups[acl._hostId])
+
+
+def exportConfig(module, client):
+    counts = {}
+    path = module.params['path']
+    tempPath = path + '.tmp'
+    if module.check_mode:
+        # count what would be exported without touching the file system
+        try:
+            for record in exportRecords(client, module.params['kinds']):
+                counts.setdefault(record['kind'], dict(exported=0))['exported'] += 1
+        except Exception as e:
+            module.fail_json(msg="Failed to read the configuration to export, error was '%s'." % str(e), counts=counts)
+        module.exit_json(changed=True, counts=counts)
+    try:
+        with gzip.open(tempPath, 'wt') as f:
+            f.write(json.dumps(dict(kind='header', version=FORMAT_VERSION, system=client.storage_system_get()._name, time=int(time.time()))) + '\n')
+            for record in exportRecords(client, module.params['kinds']):
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+                counts.setdefault(record['kind'], dict(exported=0))['exported'] += 1
+        os.rename(tempPath, path)
+    except Exception as e:
+        module.fail_json(msg="Failed to export the configuration to '%s', error was '%s'." % (path, str(e)), counts=counts)
+    finally:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+    module.exit_json(changed=True, counts=counts)
+
+
+class Importer(object):
+    """Creates the records of one kind after another, reading the state of the target grid once per kind"""
+
+    def __init__(self, module, client):
+        self._module = module
+        self._client = client
+        self._flags = module.params['flags']
+        self._existing = set()
+        self._pools = None
+        self.counts = {}
+
+    def begin(self, kind):
+        """Read which objects of the kind already exist on the grid"""
+
+        client = self._client
+        if kind == 'qospolicy':
+            self._existing = set(policy._name for policy in client.qos_policy_enum())
+        elif kind == 'volume':
+            self._existing = set(volume._name for volume in client.storage_volume_enum())
+        elif kind == 'share':
+            task, shares = client.network_share_enum()
+            self._existing = set(share._name for share in shares)
+        elif kind in ['host', 'hostgroup']:
+            self._registry = quantastor_host_registry(client)
+            if kind == 'hostgroup':
+                self._registry.group('')
+        elif kind == 'acl':
+            registry = quantastor_host_registry(client)
+            registry.group('')
+            volumeIds = dict((volume._name, volume._id) for volume in client.storage_volume_enum())
+            acls = set((acl._storageVolumeId, acl._hostId) for acl in client.storage_volume_acl_enum())
+            def exists(record):
+                target = registry.host(record['host']) or registry.group(record['host'])
+                return target is not None and (volumeIds.get(record['volume']), target.id) in acls
+            self._aclExists = exists
+        if kind in ['volume', 'share'] and self._pools is None:
+            self._pools = {}
+            for pool in client.storage_pool_enum():
+                self._pools[pool._name] = pool._id
+                self._pools[pool._id] = pool._id
+
+    def exists(self, record):
+        kind = record['kind']
+        if kind == 'host':
+            return self._registry.host(record['name']) is not None
+        if kind == 'hostgroup':
+            return self._registry.group(record['name']) is not None
+        if kind == 'acl':
+            return self._aclExists(record)
+        return record['name'] in self._existing
+
+    def create(self, record):
+        """Create the object of the record; returns 'created', 'existing' or raises an exception"""
+
+        if self.exists(record):
+            return 'existing'
+        if self._module.check_mode:
+            return 'created'
+        client = self._client
+        kind = record['kind']
+        if kind == 'qospolicy':
+            client.qos_policy_create(name=record['name'], flags=self._flags, **record['settings'])
+        elif kind == 'volume':
+            client.storage_volume_create_ex(name=record['name'], provisionableId=self._pool(record), flags=self._flags, **record['settings'])
+            qos = record.get('qos') or {}
+            if qos.get('qosPolicy') or any(str(qos.get(limit, '0')) != '0' for limit in QOS_LIMITS):
+                client.storage_volume_set_qos_controls(storageVolume=record['name'], flags=self._flags, **qos)
+        elif kind == 'share':
+            task, share, shareList = client.network_share_create_ex(name=record['name'], provisionableId=self._pool(record), flags=self._flags, **record['settings'])
+            for shareClient in record.get('nfsClients') or []:
+                if record['settings'].get('isPublic') and shareClient['clientFilter'] == PUBLIC_CLIENT_FILTER:
+                    # created together with the public share
+                    continue
+                client.network_share_client_add(networkShareId=share._id, flags=self._flags, **shareClient)
+        elif kind == 'host':
+            # also rejects ports taken by hosts created earlier in this import
+            conflicts = self._registry.reserve(record['name'], record['initiators'])
+            if conflicts:
+                raise Exception("initiator(s) %s are assigned to other hosts" % ', '.join("'%s' (host '%s')" % item for item in sorted(conflicts.items())))
+            client.host_add(hostname=record['name'], iqn=record['initiators'][0] if record['initiators'] else '',
+                            description=record['description'], flags=self._flags)
+            for port in record['initiators'][1:]:
+                client.host_initiator_add(host=record['name'], iqn=port, flags=self._flags)
+        elif kind == 'hostgroup':
+            client.host_group_create(name=record['name'], description=record['description'], hostList=','.join(record['hosts']), flags=self._flags)
+        elif kind == 'acl':
+            client.storage_volume_acl_add_remove_ex(
+                storageVolumeList=record['volume'],
+                host=record['host'],
+                modType=0, #OSN_CMN_MOD_OP_ADD
+                flags=self._flags
+                )
+        return 'created'
+
+    def _pool(self, record):
+        name = self._module.params['poolMap'].get(record['pool'], record['pool'])
+        if name not in self._pools:
+            raise Exception("storage pool '%s' does not exist" % name)
+        return self._pools[name]
+
+    def createBatch(self, batch):
+        """Create a batch of records of one kind concurrently and return the error messages"""
+
+        def createOne(record):
+            try:
+                return self.create(record), None
+            except Exception as e:
+                return None, "Failed to create %s '%s', error was '%s'." % (record['kind'], recordName(record), str(e))
+
+        executor = ThreadPoolExecutor(max_workers=max(1, self._module.params['concurrency']))
+        try:
+            results = [future.result() for future in [executor.submit(createOne, record) for record in batch]]
+        finally:
+            executor.shutdown(wait=True)
+        for (outcome, error), record in zip(results, batch):
+            if outcome:
+                counts = self.counts.setdefault(record['kind'], dict(created=0, existing=0))
+                counts[outcome] += 1
+        return [error for outcome, error in results if error]
+
+
+def recordName(record):
+    return record['name'] if 'name' in record else '%s/%s' % (record['volume'], record['host'])
+
+
+def fileSignature(path):
+    stat = os.stat(path)
+    return '%d:%d' % (stat.st_size, int(stat.st_mtime))
+
+
+def saveCheckpoint(path, signature, line, counts):
+    tempPath = path + '.tmp'
+    with open(tempPath, 'w') as f:
+        f.write(json.dumps(dict(signature=signature, line=line, counts=counts)))
+    os.rename(tempPath, path)
+
+
+def importConfig(module, client):
+    path = module.params['path']
+    checkpointPath = module.params['checkpoint'] or path + '.checkpoint'
+    useCheckpoint = not module.check_mode
+    try:
+        signature = fileSignature(path)
+    except OSError as e:
+        module.fail_json(msg="Unable to read the configuration file '%s', error was '%s'." % (path, str(e)))
+
+    importer = Importer(module, client)
+    resumedAt = 0
+    if useCheckpoint and module.params['resume'] and os.path.exists(checkpointPath):
+        with open(checkpointPath) as f:
+            checkpoint = json.load(f)
+        if checkpoint['signature'] != signature:
+            module.fail_json(msg="The checkpoint '%s' belongs to another version of '%s'; remove it or set 'resume: false' to start over." % (checkpointPath, path))
+        resumedAt = checkpoint['line']
+        importer.counts = checkpoint['counts']
+
+    committedCounts = json.loads(json.dumps(importer.counts))
+    kind = None
+    batch = []
+    batchStart = resumedAt
+    errors = []
+    try:
+        with gzip.open(path, 'rt') as f:
+            for lineNumber, line in enumerate(f):
+                if lineNumber == 0:
+                    header = json.loads(line)
+                    if header.get('kind') != 'header' or header.get('version') != FORMAT_VERSION:
+                        module.fail_json(msg="'%s' is not a configuration file of version %d." % (path, FORMAT_VERSION))
+                    continue
+                if lineNumber < resumedAt or not line.strip():
+                    continue
+                record = json.loads(line)
+                if record['kind'] not in module.params['kinds']:
+                    continue
+                if record['kind'] != kind:
+                    # all objects of the previous kind must exist before the next kind is created
+                    if kind is not None and KINDS.index(record['kind']) < KINDS.index(kind):
+                        module.fail_json(msg="Line %d of '%s' is not in dependency order: %s after %s." % (lineNumber + 1, path, record['kind'], kind))
+                    if batch:
+                        errors = importer.createBatch(batch)
+                        if errors:
+                            break
+                        batch = []
+                        committedCounts = json.loads(json.dumps(importer.counts))
+                        if useCheckpoint:
+                            saveCheckpoint(checkpointPath, signature, lineNumber, committedCounts)
+                    batchStart = lineNumber
+                    kind = record['kind']
+                    importer.begin(kind)
+                batch.append(record)
+                if len(batch) >= module.params['batchSize']:
+                    errors = importer.createBatch(batch)
+                    if errors:
+                        break
+                    batch = []
+                    batchStart = lineNumber + 1
+                    committedCounts = json.loads(json.dumps(importer.counts))
+                    if useCheckpoint:
+                        saveCheckpoint(checkpointPath, signature, batchStart, committedCounts)
+            else:
+                if batch:
+                    errors = importer.createBatch(batch)
+    except Exception as e:
+        errors.append("Failed to import the configuration from '%s', error was '%s'." % (path, str(e)))
+
+    created = sum(counts['created'] for counts in importer.counts.values())
+    if errors:
+        if useCheckpoint:
+            # the failed batch is retried on resume; what it created is then found to exist
+            saveCheckpoint(checkpointPath, signature, batchStart, committedCounts)
+        module.fail_json(msg="Import stopped at line %d of '%s', re-run to continue from there: %s" % (batchStart + 1, path, ' '.join(errors)),
+                         changed=created > 0, counts=importer.counts, resumedAt=resumedAt, checkpoint=checkpointPath)
+    if useCheckpoint and os.path.exists(checkpointPath):
+        os.remove(checkpointPath)
+    module.exit_json(changed=created > 0, counts=importer.counts, resumedAt=resumedAt)
+
+
+def main():
+    argument_spec = quantastor_argument_spec()
+    argument_spec.update(dict(
+        action=dict(type='str', required=True, choices=['export', 'import']),
+        path=dict(type='path', required=True),
+        kinds=dict(type='list', elements='str', default=KINDS, choices=KINDS),
+        poolMap=dict(type='dict', default={}),
+        checkpoint=dict(type='path'),
+        resume=dict(type='bool', default=True),
+        batchSize=dict(type='int', default=100),
+        concurrency=dict(type='int', default=8),
+        flags=dict(type='int', default=0),
+    ))
+
+    # System checks
+    module = AnsibleModule(argument_spec, supports_check_mode=True)
+    if not quantastor_sdk_enabled():
+        module.fail_json(msg='QuantaStor python SDK is required for this module.')
+    if module.params['batchSize'] < 1:
+        module.fail_json(msg="The 'batchSize' must be at least 1.")
+
+    client = quantastor_client(module)
+
+    if module.params['action'] == 'export':
+        exportConfig(module, client)
+    importConfig(module, client)
+
+
+if __name__ == '__main__':
+    main()
@@ -34,6 +34,8 @@ options:
   initiators:
     description:
     - List of iSCSI IQNs and/or FC WWPNs for the Host.
+    - IQNs are compared case-insensitively and WWPNs also without ':' or '-' separators.
+    - Before initiators are added the module fails, without making any change, if any of them is assigned to another host.
 extends_documentation_fragment:
 - quantastor
 '''
@@ -79,29 +81,15 @@ RETURN = r'''
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.quantastor import quantastor_argument_spec
-from ansible.module_utils.qs_client import quantastor_sdk_enabled
-from ansible.module_utils.qs_client import QuantastorClient
-from ansible.module_utils.qs_client import Host
-
-# Helper function forms 2 sets from given arguments and _initiatorPortList then returns 
-# the Difference-set or the Intersection-set based on the given mode (true: intersection, false: difference).
-def getIntersectionDifference(argset, hostset, mode):
-    ret = set()
-    tempArgs = set()
-    tempHosts = set()
-
-    for arg in argset:
-        tempArgs.add(arg)
-    for init in hostset:
-        tempHosts.add(init['name'])
-
-    if mode:
-        ret = tempArgs.intersection(tempHosts)
-    else:
-        ret = tempArgs.difference(tempHosts)
+from ansible.module_utils.quantastor import (quantastor_argument_spec, quantastor_client, quantastor_host_registry,
+    quantastor_journal, quantastor_sdk_enabled, QuantastorHostRecord)
 
-    return ret
+# Fails the module if any of the initiator ports are already assigned to a host other than the given one.
+def checkPortConflicts(module, registry, ports, host=None):
+    conflicts = registry.conflicts(ports, host)
+    if conflicts:
+        module.fail_json(msg="The initiator(s) %s are already assigned to other hosts." % ', '.join("'%s' (host '%s')" % (port, owner) for port, owner in sorted(conflicts.items())),
+                         conflicts=conflicts)
 
 
 def main():
@@ -122,11 +110,22 @@ def main():
     if not quantastor_sdk_enabled():
         module.fail_json(msg='QuantaStor python SDK is required for this module.')
 
-    client = QuantastorClient.from_module(module)
+    client = quantastor_client(module)
+
+    # Skip all further REST calls if these parameters were already applied and the host/hostgroup has not changed since.
+    # Volume assignments are not journaled.
+    journal = None
+    if not module.params['volume']:
+        journal = quantastor_journal(module, client)
+    journalKind = 'host' if module.params['host'] else 'hostgroup'
+    journalName = module.params['host'] or module.params['hostgroup']
+    if journal and journal.is_current(journalKind, journalName):
+        module.exit_json(changed=False)
+
     try:
         client.storage_system_get()
-    except:
-        module.fail_json(msg='Unable to gather QuantaStor system information.')
+    except Exception as e:
+        module.fail_json(msg="Unable to gather QuantaStor system information, error was '%s'." % str(e))
 
     # Operation Variables
     state = module.params['state']    
@@ -162,6 +161,8 @@ def main():
                 task, hostgroup = client.host_group_get(hostGroup=module.params['hostgroup'])
                 # case: Trying to create a hostgroup with name that already exists.
                 if module.params['hosts']:
+                    if journal:
+                        journal.record('hostgroup', journalName, hostgroup)
                     module.exit_json(changed=False)
                 hostId = module.params['hostgroup']
             except Exception as e:
@@ -196,6 +197,8 @@ def main():
                 hostId = module.params['host']
             except Exception as e:
                 if not (module.params['initiators'] or module.params['volume']):
+                    if journal:
+                        journal.record('host', journalName, None)
                     module.exit_json(changed=False)
                 else:
                     module.fail_json(msg="Cannot remove host entry '%s' because it does not exist. Error was '%s'" % (module.params['host'],str(e)))
@@ -207,6 +210,8 @@ def main():
                 hostId = module.params['hostgroup']
             except Exception as e:
                 if not (module.params['volume']):
+                    if journal:
+                        journal.record('hostgroup', journalName, None)
                     module.exit_json(changed=False)
                 else:
                     module.fail_json(msg="Cannot remove hostgroup '%s' because it does not exist. Error was '%s'" % (module.params['hostgroup'],str(e)))
@@ -229,6 +234,10 @@ def main():
     if state == 'present':
         #CREATE HOST GROUP
         if not hostgroup and module.params['hosts']:
+            registry = quantastor_host_registry(client)
+            unknownHosts = [name for name in module.params['hosts'] if registry.host(name) is None]
+            if unknownHosts:
+                module.fail_json(msg="Cannot create host group '%s' because the host(s) '%s' do not exist." % (module.params['hostgroup'], "', '".join(unknownHosts)))
             try:
                 client.host_group_create(
                     name=module.params['hostgroup'],
@@ -236,6 +245,8 @@ def main():
                     hostList=module.params['hosts'],
                     flags=module.params['flags']
                     )
+                if journal:
+                    journal.refresh('hostgroup', journalName)
                 module.exit_json(changed=True)
             except Exception as e: 
                 module.fail_json(msg="Failed to create host group '%s' with hosts '%s', error was '%s'." % (module.params['hostgroup'], ','.join(module.params['hosts']), str(e)))
@@ -255,6 +266,8 @@ def main():
 
         #ADD HOST ENTRY
         elif not host and module.params['initiators'] and module.params['host']:
+            # check all ports up front so that a conflict does not leave a host with only some of its initiators
+            checkPortConflicts(module, quantastor_host_registry(client), module.params['initiators'])
             try:
                 client.host_add(
                         hostname=module.params['host'], 
@@ -273,6 +286,8 @@ def main():
                             )
                     except Exception as e: 
                         module.fail_json(msg="Failed to create new host initiator entry '%s', error was '%s'." % (port, str(e)))
+                if journal:
+                    journal.refresh('host', journalName)
                 module.exit_json(changed=True)
             except Exception as e: 
                 module.fail_json(msg="Failed to create new host entry '%s', error was '%s'." % (module.params['host'], str(e)))
@@ -280,15 +295,20 @@ def main():
 
         #ADD HOST INITIATORS TO HOST ENTRY
         elif host and module.params['initiators']:
-            missingInitiators = getIntersectionDifference(module.params['initiators'],host._initiatorPortList,False) #return difference
+            missingInitiators = QuantastorHostRecord.from_host(host).missing(module.params['initiators'])
             if len(missingInitiators) > 0:
+                checkPortConflicts(module, quantastor_host_registry(client), missingInitiators, host._id)
                 for port in missingInitiators:
                     try:
                         client.host_initiator_add(host=module.params['host'], iqn=port)
                     except Exception as e: 
                         module.fail_json(msg="Failed to create new host initiator entry '%s', error was '%s'." % (port, str(e)))
+                if journal:
+                    journal.refresh('host', journalName)
                 module.exit_json(changed=True)
             else:
+                if journal:
+                    journal.record('host', journalName, host)
                 module.exit_json(changed=False)
 
     # Delete/Remove operations
@@ -297,6 +317,8 @@ def main():
         if hostgroup and not module.params['volume']:
             try:
                 client.host_group_delete(hostGroup=module.params['hostgroup'])
+                if journal:
+                    journal.record('hostgroup', journalName, None)
                 module.exit_json(changed=True)
             except Exception as e: 
                 module.fail_json(msg="Failed to delete host group '%s', error was '%s'." % (module.params['hostgroup'], str(e)))
@@ -319,6 +341,8 @@ def main():
         elif host and not module.params['volume'] and not module.params['initiators']:
             try:
                 client.host_remove(module.params['host'])
+                if journal:
+                    journal.record('host', journalName, None)
                 module.exit_json(changed=True)
             except Exception as e: 
                 module.fail_json(msg="Failed to remove host entry '%s', error was '%s'." % (module.params['host'], str(e)))
@@ -326,15 +350,19 @@ def main():
 
         #REMOVE HOST INITIATORS FROM HOST
         elif host and module.params['initiators']:
-            removeInitiators = getIntersectionDifference(module.params['initiators'],host._initiatorPortList,True) # return intersection
+            removeInitiators = QuantastorHostRecord.from_host(host).held(module.params['initiators'])
             if len(removeInitiators) > 0:
                 for port in removeInitiators:
                     try:
                         client.host_initiator_remove(module.params['host'], port)
                     except Exception as e: 
                         module.fail_json(msg="Failed to remove host initiator entry '%s', error was '%s'." % (port, str(e)))
+                if journal:
+                    journal.refresh('host', journalName)
                 module.exit_json(changed=True)
             else:
+                if journal:
+                    journal.record('host', journalName, host)
                 module.exit_json(changed=False)
 
     else:
@@ -0,0 +1,297 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2019, OSNEXUS Engineering (eng@osnexus.com)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+module: quantastor_multi
+version_added: '4.6'
+short_description: Apply the same snapshot or access change to many independent QuantaStor systems at once
+description:
+- Applies one operation to a list of independent QuantaStor systems (not members of one grid) concurrently from a single task.
+- The systems are driven from an asyncio event loop, so the task takes as long as the slowest system rather than the sum of all systems.
+- Results are reported per system. The task fails if the operation failed on any system.
+author:
+- OSNEXUS Engineering
+options:
+  quantastor_hostnames:
+    description:
+    - List of QuantaStor systems to apply the operation to. Entries are either hostnames/IPs, which use the common quantastor_username,
+      quantastor_password and quantastor_cert, or dictionaries with 'hostname' and optional 'username', 'password' and 'cert' keys.
+    - Every hostname may only be listed once, as the results are returned per hostname.
+    required: true
+  operation:
+    description:
+    - volume_snapshot creates snapshot 'snapshot' of storage volume 'volume'.
+    - share_snapshot creates snapshot 'snapshot' of network share 'share'.
+    - volume_assign / volume_unassign adds / removes the assignment of storage volume 'volume' to host or host group 'host'.
+    - share_client_add / share_client_remove adds / removes NFS client access entry 'clientFilter' on network share 'share'.
+    required: true
+    choices: [ volume_snapshot, share_snapshot, volume_assign, volume_unassign, share_client_add, share_client_remove ]
+  volume:
+    description:
+    - Name of the storage volume (volume_snapshot, volume_assign, volume_unassign).
+  share:
+    description:
+    - Name of the network share (share_snapshot, share_client_add, share_client_remove).
+  snapshot:
+    description:
+    - Name of the snapshot to create. Snapshots that already exist are left alone.
+  description:
+    description:
+    - Description of the new snapshot.
+  host:
+    description:
+    - Name of the host or host group for volume assignments.
+  clientFilter:
+    description:
+    - NFS client filter (eg. '10.0.0.0/24' or '*') for share client access entries.
+  readOnly:
+    description:
+    - Set to 'true' to make a new NFS client access entry read-only.
+    default: false
+  concurrency:
+    description:
+    - Maximum number of QuantaStor systems worked on at the same time.
+    default: 16
+  flags:
+    description:
+    - Optional flags for the operation.
+extends_documentation_fragment:
+- quantastor
+'''
+
+EXAMPLES = r'''
+- name: Snapshot volume "dbvolume" on every appliance
+  quantastor_multi:
+    quantastor_hostnames: "{{ groups['qsservers'] }}"
+    quantastor_username: admin
+    quantastor_password: password
+    operation: volume_snapshot
+    volume: dbvolume
+    snapshot: dbvolume-pre-upgrade
+    description: taken before upgrade
+
+- name: Give the backup subnet read-only NFS access to "shareA" on two appliances with different credentials
+  quantastor_multi:
+    quantastor_hostnames:
+    - hostname: 10.10.10.2
+      password: password1
+    - hostname: 10.10.20.2
+      password: password2
+    operation: share_client_add
+    share: shareA
+    clientFilter: 10.0.50.0/24
+    readOnly: true
+'''
+
+RETURN = r'''
+results:
+  description: Per QuantaStor system result of the operation.
+  returned: always
+  type: dict
+  sample: {"10.10.10.2": {"changed": true, "failed": false, "msg": "", "elapsed": 0.42}}
+'''
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.quantastor import quantastor_argument_spec, quantastor_client, quantastor_sdk_enabled
+
+# operation -> parameters that must be specified for it
+REQUIRED_PARAMS = {
+    'volume_snapshot': ['volume', 'snapshot'],
+    'share_snapshot': ['share', 'snapshot'],
+    'volume_assign': ['volume', 'host'],
+    'volume_unassign': ['volume', 'host'],
+    'share_client_add': ['share', 'clientFilter'],
+    'share_client_remove': ['share', 'clientFilter'],
+}
+
+
+def volumeSnapshot(client, params, checkMode):
+    try:
+        client.storage_volume_get(storageVolume=params['snapshot'])
+        return False
+    except Exception:
+        pass
+    if not checkMode:
+        client.storage_volume_snapshot(
+            storageVolume=params['volume'],
+            snapshotName=params['snapshot'],
+            description=params['description'],
+            count=1,
+            flags=params['flags']
+            )
+    return True
+
+
+def shareSnapshot(client, params, checkMode):
+    try:
+        client.network_share_get(networkShare=params['snapshot'])
+        return False
+    except Exception:
+        pass
+    if not checkMode:
+        client.network_share_snapshot(
+            networkShare=params['share'],
+            snapshotName=params['snapshot'],
+            description=params['description'],
+            isActive=True,
+            flags=params['flags']
+            )
+    return True
+
+
+def volumeAssign(client, params, checkMode):
+    assigned = True
+    try:
+        client.storage_volume_acl_get(storageVolume=params['volume'], host=params['host'])
+    except Exception:
+        assigned = False
+    add = params['operation'] == 'volume_assign'
+    if assigned == add:
+        return False
+    if not checkMode:
+        client.storage_volume_acl_add_remove_ex(
+            storageVolumeList=params['volume'],
+            host=params['host'],
+            modType=0 if add else 1, #OSN_CMN_MOD_OP_ADD / OSN_CMN_MOD_OP_REMOVE
+            flags=params['flags']
+            )
+    return True
+
+
+def shareClient(client, params, checkMode):
+    task, share = client.network_share_get(networkShare=params['share'])
+    existing = None
+    for shareClient in client.network_share_client_enum(networkShare=share._id):
+        if shareClient._clientFilter == params['clientFilter']:
+            existing = shareClient
+    add = params['operation'] == 'share_client_add'
+    if (existing is not None) == add:
+        return False
+    if not checkMode:
+        if add:
+            client.network_share_client_add(
+                networkShareId=share._id,
+                clientFilter=params['clientFilter'],
+                readOnly=params['readOnly'],
+                flags=params['flags']
+                )
+        else:
+            client.network_share_client_remove(
+                networkShareId=share._id,
+                networkShareClientId=existing._id,
+                flags=params['flags']
+                )
+    return True
+
+
+OPERATIONS = {
+    'volume_snapshot': volumeSnapshot,
+    'share_snapshot': shareSnapshot,
+    'volume_assign': volumeAssign,
+    'volume_unassign': volumeAssign,
+    'share_client_add': shareClient,
+    'share_client_remove': shareClient,
+}
+
+
+def applyOperation(module, target):
+    """Run the module's operation against one QuantaStor system and return its result dictionary"""
+
+    start = time.time()
+    result = dict(changed=False, failed=False, msg='')
+    try:
+        client = quantastor_client(module, target.get('hostname'), target.get('username'), target.get('password'), target.get('cert'))
+        result['changed'] = OPERATIONS[module.params['operation']](client, module.params, module.check_mode)
+    except Exception as e:
+        result['failed'] = True
+        result['msg'] = "Operation '%s' failed, error was '%s'." % (module.params['operation'], str(e))
+    result['elapsed'] = round(time.time() - start, 3)
+    return result
+
+
+def applyAll(module, targets):
+    """Apply the module's operation to all targets concurrently and return a dictionary of per-target results"""
+
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=max(1, module.params['concurrency']))
+
+    async def applyOne(target):
+        return target['hostname'], await loop.run_in_executor(executor, applyOperation, module, target)
+
+    async def applyEach():
+        return await asyncio.gather(*[applyOne(target) for target in targets])
+
+    try:
+        results = loop.run_until_complete(applyEach())
+    finally:
+        executor.shutdown(wait=True)
+        loop.close()
+    return dict(results)
+
+
+def main():
+    argument_spec = quantastor_argument_spec()
+    argument_spec.update(dict(
+        quantastor_hostnames=dict(type='list', required=True),
+        operation=dict(type='str', required=True, choices=list(REQUIRED_PARAMS)),
+        volume=dict(type='str'),
+        share=dict(type='str'),
+        snapshot=dict(type='str'),
+        description=dict(type='str', default=''),
+        host=dict(type='str'),
+        clientFilter=dict(type='str'),
+        readOnly=dict(type='bool', default=False),
+        concurrency=dict(type='int', default=16),
+        flags=dict(type='int', default=0),
+    ))
+
+    # System checks
+    module = AnsibleModule(argument_spec, supports_check_mode=True)
+    if not quantastor_sdk_enabled():
+        module.fail_json(msg='QuantaStor python SDK is required for this module.')
+
+    # Bailout checks
+    for param in REQUIRED_PARAMS[module.params['operation']]:
+        if not module.params[param]:
+            module.fail_json(msg="The '%s' operation requires the '%s' parameter to be specified." % (module.params['operation'], param))
+
+    targets = []
+    seen = set()
+    for target in module.params['quantastor_hostnames']:
+        if not isinstance(target, dict):
+            target = dict(hostname=str(target))
+        if not target.get('hostname'):
+            module.fail_json(msg="Every entry of 'quantastor_hostnames' must specify a hostname.")
+        if target.get('password'):
+            module.no_log_values.add(target['password'])
+        if target['hostname'] in seen:
+            module.fail_json(msg="The QuantaStor system '%s' is listed more than once in 'quantastor_hostnames'." % target['hostname'])
+        seen.add(target['hostname'])
+        targets.append(target)
+
+    results = applyAll(module, targets)
+
+    failed = [hostname for hostname, result in results.items() if result['failed']]
+    changed = any(result['changed'] for result in results.values())
+    if failed:
+        module.fail_json(msg="Operation '%s' failed on %d of %d QuantaStor systems: %s." % (module.params['operation'], len(failed), len(results), ', '.join(sorted(failed))),
+                         changed=changed, results=results)
+    module.exit_json(changed=changed, results=results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,423 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2019, OSNEXUS Engineering (eng@osnexus.com)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+module: quantastor_replication
+version_added: '4.6'
+short_description: Manage remote replication of many QuantaStor storage volumes and network shares
+description:
+- Creates a replication schedule for a list of storage volumes and network shares, or adds them to an existing schedule.
+- Sets the bandwidth limit of the storage system link the replicas are sent over.
+- Starts the initial replication or a resync of every listed volume and share, with at most 'concurrency' transfers running at the same
+  time, and reports the progress and transfer rate of every replica.
+- The storage system link to the remote system must already exist.
+author:
+- OSNEXUS Engineering
+options:
+  remoteSystem:
+    description:
+    - Storage system link to replicate over, given by the link name or ID, the remote storage system ID or the remote IP address.
+    required: true
+  volumes:
+    description:
+    - List of storage volume names or IDs to replicate.
+  shares:
+    description:
+    - List of network share names or IDs to replicate.
+  schedule:
+    description:
+    - Name of the replication schedule holding the volumes and shares. If omitted no schedule is managed.
+    - Settings of an existing schedule are left alone, only its volumes and shares are managed.
+  state:
+    description:
+    - With 'present' the volumes and shares are added to the schedule, which is created if it does not exist.
+    - With 'absent' the volumes and shares are removed from the schedule, or the whole schedule is deleted if no volumes or shares are given.
+    choices: [ present, absent ]
+    default: present
+  targetPool:
+    description:
+    - Storage pool on the remote system receiving the replicas. Required to create a schedule or an initial replica.
+  description:
+    description:
+    - Description of a new replication schedule.
+  hoursOfDay:
+    description:
+    - List of hours (0-23) at which a new schedule replicates.
+  daysOfWeek:
+    description:
+    - List of days (eg. 'mon', 'tue' or 0-6 with 0 being Sunday) on which a new schedule replicates. Defaults to every day.
+  maxReplicas:
+    description:
+    - Number of replica checkpoints a new schedule retains.
+    default: 5
+  enabled:
+    description:
+    - Whether a new schedule is enabled.
+    default: true
+  bandwidthLimit:
+    description:
+    - Bandwidth limit of the storage system link in MB/s, 0 removes the limit. If omitted the current limit is left alone.
+  action:
+    description:
+    - With 'sync' a replica is created for every volume and share that has none on the remote system yet, and all other replicas are resynced.
+    - With 'none' no transfers are started; the progress of the replicas is only reported.
+    choices: [ none, sync ]
+    default: none
+  concurrency:
+    description:
+    - Maximum number of transfers running at the same time. A new transfer is started when a running one completes.
+    default: 2
+  wait:
+    description:
+    - Wait for the transfers to complete. Without waiting all transfers are started right away and 'concurrency' only limits the number
+      of start requests in flight.
+    default: true
+  timeout:
+    description:
+    - Seconds to wait for each transfer, 0 waits until the transfer completes.
+    default: 0
+  pollInterval:
+    description:
+    - Seconds between progress checks of a running transfer.
+    default: 10
+  flags:
+    description:
+    - Optional flags for the operation.
+extends_documentation_fragment:
+- quantastor
+'''
+
+EXAMPLES = r'''
+- name: Replicate two volumes and a share hourly to the DR site, throttling the link to 100 MB/s and seeding them two at a time
+  quantastor_replication:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    remoteSystem: 10.10.20.2
+    schedule: dr-hourly
+    volumes:
+    - dbvolume
+    - logvolume
+    shares:
+    - homeshare
+    targetPool: DRPool
+    hoursOfDay: "{{ range(0, 24) | list }}"
+    bandwidthLimit: 100
+    action: sync
+    concurrency: 2
+
+- name: Report replication progress without starting transfers
+  quantastor_replication:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    remoteSystem: 10.10.20.2
+    volumes:
+    - dbvolume
+  register: replication
+'''
+
+RETURN = r'''
+link:
+  description: ID of the storage system link.
+  returned: always
+  type: str
+schedule:
+  description: ID of the replication schedule.
+  returned: when 'schedule' is given and the schedule exists
+  type: str
+replicas:
+  description: Per volume and share replication state. transferSpeed, amountTransferred and estTotalTransfer are reported as returned by the appliance.
+  returned: always
+  type: dict
+  sample: {"dbvolume": {"changed": true, "failed": false, "msg": "", "elapsed": 512.3, "replica": "8f3c...", "progress": 100,
+           "replicationState": 0, "transferSpeed": "104857600", "amountTransferred": "53687091200", "estTotalTransfer": "53687091200"}}
+'''
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.quantastor import (quantastor_argument_spec, quantastor_client, quantastor_schedule_masks,
+    quantastor_sdk_enabled)
+
+# Task states reported by taskGet
+TASK_STATE_FAILED = 3
+TASK_STATE_CANCELLED = 4
+TASK_STATE_COMPLETED = 5
+
+
+def findLink(client, remoteSystem):
+    for link in client.storage_system_link_enum():
+        if remoteSystem in [link._id, link._name, link._remoteStorageSystemId, link._remoteIpAddress]:
+            return link
+    raise Exception("No storage system link to '%s' found." % remoteSystem)
+
+
+def findReplicatables(client, volumes, shares):
+    """Resolve volume and share names or IDs with one enumeration per type and return a list of {kind, name, id} dictionaries"""
+
+    items = []
+    for kind, names, enum in [('volume', volumes, lambda: client.storage_volume_enum()),
+                              ('share', shares, lambda: client.network_share_enum()[1])]:
+        if not names:
+            continue
+        byKey = {}
+        for obj in enum():
+            byKey[obj._id] = obj
+            byKey[obj._name] = obj
+        for name in names:
+            if name not in byKey:
+                raise Exception("The %s '%s' does not exist." % (kind, name))
+            items.append(dict(kind=kind, name=name, id=byKey[name]._id))
+    return items
+
+
+def ensureBandwidth(module, client, link):
+    limit = module.params['bandwidthLimit']
+    if limit is None or int(link._bandwidthLimit) == limit:
+        return False
+    if not module.check_mode:
+        # pass the current settings of the link, which would otherwise be reset
+        client.storage_system_link_modify(
+            linkId=link._id,
+            remoteIpAddress=link._remoteIpAddress,
+            localIpAddress=link._localIpAddress,
+            bandwidthLimit=str(limit),
+            linkType=link._linkType,
+            description=link._description,
+            flags=module.params['flags']
+            )
+    return True
+
+
+def ensureSchedule(module, client, link, items):
+    """Create, update the members of or delete the replication schedule. Returns (changed, schedule ID)"""
+
+    name = module.params['schedule']
+    task, schedules = client.replication_schedule_enum()
+    schedule = None
+    for candidate in schedules:
+        if name in [candidate._id, candidate._name]:
+            schedule = candidate
+
+    volumeIds = [item['id'] for item in items if item['kind'] == 'volume']
+    shareIds = [item['id'] for item in items if item['kind'] == 'share']
+
+    if module.params['state'] == 'absent':
+        if schedule is None:
+            return False, None
+        if not items:
+            if not module.check_mode:
+                client.replication_schedule_delete(schedule=schedule._id, flags=module.params['flags'])
+            return True, None
+        members = set(assoc._replicatableId for assoc in client.replication_schedule_assoc_enum(schedule=schedule._id))
+        volumeIds = [id for id in volumeIds if id in members]
+        shareIds = [id for id in shareIds if id in members]
+        if not volumeIds and not shareIds:
+            return False, schedule._id
+        if not module.check_mode:
+            client.replication_schedule_add_remove(
+                schedule=schedule._id,
+                modType='1', #OSN_CMN_MOD_OP_REMOVE
+                storageVolumeList=','.join(volumeIds),
+                networkShareList=','.join(shareIds),
+                flags=module.params['flags']
+                )
+        return True, schedule._id
+
+    if schedule is None:
+        if not module.params['targetPool']:
+            raise Exception("To create replication schedule '%s', the 'targetPool' parameter must be specified." % name)
+        hoursOfDay, daysOfWeek = quantastor_schedule_masks(module.params['hoursOfDay'], module.params['daysOfWeek'] or range(7))
+        if module.check_mode:
+            return True, None
+        task, schedule = client.replication_schedule_create(
+            name=name,
+            description=module.params['description'],
+            storageSystemLinkId=link._id,
+            targetProvisionableId=module.params['targetPool'],
+            setEnabled='1' if module.params['enabled'] else '0',
+            maxReplicas=str(module.params['maxReplicas']),
+            daysOfWeek=str(daysOfWeek),
+            hoursOfDay=str(hoursOfDay),
+            storageVolumeList=','.join(volumeIds),
+            networkShareList=','.join(shareIds),
+            flags=module.params['flags']
+            )
+        return True, schedule._id
+
+    members = set(assoc._replicatableId for assoc in client.replication_schedule_assoc_enum(schedule=schedule._id))
+    volumeIds = [id for id in volumeIds if id not in members]
+    shareIds = [id for id in shareIds if id not in members]
+    if not volumeIds and not shareIds:
+        return False, schedule._id
+    if not module.check_mode:
+        client.replication_schedule_add_remove(
+            schedule=schedule._id,
+            modType='0', #OSN_CMN_MOD_OP_ADD
+            storageVolumeList=','.join(volumeIds),
+            networkShareList=','.join(shareIds),
+            flags=module.params['flags']
+            )
+    return True, schedule._id
+
+
+def replicaStatus(replica):
+    if replica is None or not replica._id:
+        return dict(replica=None, progress=0, replicationState=None, transferSpeed=None, amountTransferred=None, estTotalTransfer=None)
+    return dict(
+        replica=replica._id,
+        progress=int(replica._progress or 0),
+        replicationState=int(replica._replicationState or 0),
+        transferSpeed=replica._transferSpeed,
+        amountTransferred=replica._amountTransferred,
+        estTotalTransfer=replica._estTotalTransfer,
+        )
+
+
+def waitForTask(module, client, task, replica):
+    """Poll the transfer task until it finishes, returning the last seen state of the replica"""
+
+    deadline = time.time() + module.params['timeout'] if module.params['timeout'] else None
+    while True:
+        state = client.task_get(id=task._id)
+        if replica is not None and replica._id:
+            replica = client.replica_assoc_get(assocId=replica._id)
+        taskState = int(state._taskState or 0)
+        if taskState == TASK_STATE_COMPLETED:
+            return replica
+        if taskState in (TASK_STATE_FAILED, TASK_STATE_CANCELLED):
+            raise Exception("Replication task '%s' did not complete, error was '%s'." % (task._id, state._errorMessage or state._description))
+        if deadline and time.time() > deadline:
+            raise Exception("Replication task '%s' did not complete within %d seconds." % (task._id, module.params['timeout']))
+        time.sleep(module.params['pollInterval'])
+
+
+def syncReplica(module, client, link, item, replica):
+    """Create or resync the replica of one volume or share and return its result dictionary"""
+
+    start = time.time()
+    result = dict(changed=True, failed=False, msg='')
+    try:
+        if not module.check_mode:
+            if replica is None:
+                if not module.params['targetPool']:
+                    raise Exception("To create the initial replica, the 'targetPool' parameter must be specified.")
+                task, replica = client.replica_create(
+                    replicatableId=item['id'],
+                    storageSystemLinkId=link._id,
+                    replicaName=item['name'],
+                    targetStoragePoolId=module.params['targetPool'],
+                    flags=module.params['flags']
+                    )
+            else:
+                task, replica = client.replica_sync(assocId=replica._id, flags=module.params['flags'])
+            if module.params['wait']:
+                replica = waitForTask(module, client, task, replica)
+    except Exception as e:
+        result['failed'] = True
+        result['msg'] = "Replication of %s '%s' failed, error was '%s'." % (item['kind'], item['name'], str(e))
+    result.update(replicaStatus(replica))
+    result['elapsed'] = round(time.time() - start, 3)
+    return result
+
+
+def main():
+    argument_spec = quantastor_argument_spec()
+    argument_spec.update(dict(
+        remoteSystem=dict(type='str', required=True),
+        volumes=dict(type='list', default=[]),
+        shares=dict(type='list', default=[]),
+        schedule=dict(type='str'),
+        state=dict(type='str', default='present', choices=['present', 'absent']),
+        targetPool=dict(type='str'),
+        description=dict(type='str', default=''),
+        hoursOfDay=dict(type='list', default=[]),
+        daysOfWeek=dict(type='list', default=[]),
+        maxReplicas=dict(type='int', default=5),
+        enabled=dict(type='bool', default=True),
+        bandwidthLimit=dict(type='int'),
+        action=dict(type='str', default='none', choices=['none', 'sync']),
+        concurrency=dict(type='int', default=2),
+        wait=dict(type='bool', default=True),
+        timeout=dict(type='int', default=0),
+        pollInterval=dict(type='int', default=10),
+        flags=dict(type='int', default=0),
+    ))
+
+    # System checks
+    module = AnsibleModule(argument_spec, supports_check_mode=True)
+    if not quantastor_sdk_enabled():
+        module.fail_json(msg='QuantaStor python SDK is required for this module.')
+
+    # Bailout checks
+    if module.params['state'] == 'absent' and not module.params['schedule']:
+        module.fail_json(msg="To remove volumes or shares from replication, the 'schedule' parameter must be specified.")
+    if module.params['state'] == 'absent' and module.params['action'] == 'sync':
+        module.fail_json(msg="The 'sync' action can not be combined with state 'absent'.")
+
+    client = quantastor_client(module)
+
+    try:
+        link = findLink(client, module.params['remoteSystem'])
+        items = findReplicatables(client, module.params['volumes'], module.params['shares'])
+    except Exception as e:
+        module.fail_json(msg="Unable to gather replication information, error was '%s'." % str(e))
+
+    result = dict(changed=False, link=link._id)
+
+    try:
+        result['changed'] = ensureBandwidth(module, client, link)
+    except Exception as e:
+        module.fail_json(msg="Failed to set the bandwidth limit of storage system link '%s', error was '%s'." % (link._id, str(e)))
+
+    if module.params['schedule']:
+        try:
+            changed, result['schedule'] = ensureSchedule(module, client, link, items)
+            result['changed'] = result['changed'] or changed
+        except Exception as e:
+            module.fail_json(msg="Failed to update replication schedule '%s', error was '%s'." % (module.params['schedule'], str(e)), **result)
+
+    # find the existing replica of every volume and share on the remote system of the link with one enumeration
+    replicas = {}
+    try:
+        for replica in client.replica_assoc_enum(sourcesOnly=True):
+            if replica._targetStorageSystemId == link._remoteStorageSystemId and replica._sourceId not in replicas:
+                replicas[replica._sourceId] = replica
+    except Exception as e:
+        module.fail_json(msg="Unable to gather replica information, error was '%s'." % str(e), **result)
+
+    if module.params['action'] == 'sync' and items:
+        # every worker waits for its transfer to complete before taking the next, so at most 'concurrency' transfers run at once
+        executor = ThreadPoolExecutor(max_workers=max(1, module.params['concurrency']))
+        try:
+            futures = [(item, executor.submit(syncReplica, module, client, link, item, replicas.get(item['id']))) for item in items]
+            result['replicas'] = dict((item['name'], future.result()) for item, future in futures)
+        finally:
+            executor.shutdown(wait=True)
+        result['changed'] = True
+    else:
+        result['replicas'] = {}
+        for item in items:
+            result['replicas'][item['name']] = dict(changed=False, failed=False, msg='')
+            result['replicas'][item['name']].update(replicaStatus(replicas.get(item['id'])))
+
+    failed = [name for name, replica in result['replicas'].items() if replica['failed']]
+    if failed:
+        module.fail_json(msg="Replication failed for %d of %d volumes and shares: %s." % (len(failed), len(items), ', '.join(sorted(failed))), **result)
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
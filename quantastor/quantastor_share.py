@@ -19,6 +19,9 @@ version_added: '4.6'
 short_description: Manage Network share operations within QuantaStor Storage Grid
 description:
 - Create, delete or modify Network shares within a QuantaStor storage grid.
+- The parameters of a new share are validated before any change is made, but each task only validates its own share. To
+  reject a whole batch of shares when any of them is invalid, before any share is created, run the batch twice, first with
+  check_mode and any_errors_fatal set to true and then without, as in the examples and playbooks/qstest_validateshares.yml.
 author:
 - Steven Umbehocker, Seth Cagampang
 
@@ -35,7 +38,11 @@ options:
     - Specify what type of share is to be created, this field is not needed to delete any type of share (*normal, alias, subshare, snapshot).
   pool:
     description:
-    - Specify the storage pool used for this share.
+    - Specify the storage pool used for this share. Set to 'auto' to have a pool chosen based on free space and the placements
+      recently made on each pool and storage system, so that a batch of new shares is spread across pools and nodes.
+  poolCandidates:
+    description:
+    - With 'pool: auto', list of pool names (shell-style wildcards allowed) or IDs to choose from. Defaults to all pools.
   ownerUser:
     description:
     - Assign a user as the owner of this share.
@@ -47,7 +54,7 @@ options:
     - Set a quota size for the networkshare specified in Bytes (OK: KiB, KB, MiB, MB, GiB, GB, TiB, TB). Default value is 0.
   recordSizeKb:
     description:
-    - Set a size for storage blocks. Argument must be a power of 2. Size will be set in KB. Default value is 0.
+    - Set a size for storage blocks. Argument must be a power of 2. Size will be set in KB. Default value is 0, or the value of the selected profile.
   publicNFS:
     description:
     - A boolean argument to set the 'isPublic' parameter. Default value is True.
@@ -63,6 +70,13 @@ options:
   userAccessList:
     description:
     - Specifies users and groups to be valid, invalid, or none in the form 'user1:value1,user2:value2,@group1:value3'. Prepend with tilde (~) to remove access assignment. Prepend with '@' to specify a user group.
+  validateDirectory:
+    description:
+    - Check that 'ownerUser', 'ownerGroup' and the users and groups of 'userAccessList' exist on the QuantaStor system before the share is created.
+      Numeric IDs, 'root' and domain names (DOMAIN\name) are not checked. Disable when the names come from a directory service the system is joined to.
+    - All parameters of the share are validated before any change is made. Validation is per task, see the description for rejecting
+      a whole batch.
+    default: true
   syncPolicy:
     description:
     - Used for handling writes to the storage pool with options 'always', 'disabled', or 'standard'. standard mode is a hybrid of write-through and write-back caching based on the O_SYNC flag, always mode is write-through to ZIL which could be SSD cache, and disabled indicates to always use async writes.
@@ -84,6 +98,16 @@ options:
   description:
     description:
     - Adds a description to the newly created network share.
+  profile:
+    description:
+    - Workload profile that sets vetted values for recordSizeKb, syncPolicy, compressionType, copies and quotaExcludeSnapshots.
+      Any of these parameters given explicitly override the profile's value.
+    - Built-in profiles are database, vm-images, media (alias streaming), backup-target and small-file. Additional profiles may be
+      defined in 'profileFile'.
+  profileFile:
+    description:
+    - Path to a YAML or JSON file mapping profile names to settings, eg. "{analytics: {extends: database, recordSizeKb: '128'}}".
+      A profile may extend a built-in or another file profile with the 'extends' key. Profiles in the file replace built-in profiles of the same name.
 
 Share-Delete options:
   deleteChildren:
@@ -164,6 +188,40 @@ EXAMPLES = r'''
     pool: DefaultPool140
     description: desc-4-shareA
 
+- name: Create a share for a database server using the database tuning profile, keeping 2 copies of each block
+  quantastor_share:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    share: pgdata
+    pool: DefaultPool
+    profile: database
+    copies: 2
+
+- name: Validate a batch of shares first, so that no share is created if any of them is invalid
+  quantastor_share:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    share: "{{ item.share }}"
+    pool: DefaultPool
+    ownerUser: "{{ item.ownerUser }}"
+    quota: "{{ item.quota }}"
+  loop: "{{ shares }}"
+  check_mode: true
+  any_errors_fatal: true
+
+- name: Then create the validated shares
+  quantastor_share:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    share: "{{ item.share }}"
+    pool: DefaultPool
+    ownerUser: "{{ item.ownerUser }}"
+    quota: "{{ item.quota }}"
+  loop: "{{ shares }}"
+
 - name:  create a subshare called subA
   quantastor_share:
     quantastor_hostname: 10.10.10.2
@@ -215,12 +273,157 @@ EXAMPLES = r'''
 '''
 
 RETURN = r'''
+pool:
+  description: Name of the storage pool chosen for a new share when 'pool' is set to 'auto'.
+  returned: when a share was created with 'pool: auto'
+  type: str
+settings:
+  description: Effective tuning settings of a normal share after applying the profile and any explicitly given parameters.
+  returned: when state is present and shareType is normal
+  type: dict
+  sample: {"recordSizeKb": "16", "syncPolicy": "always", "compressionType": "lz4", "copies": "1", "quotaExcludeSnapshots": true}
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.quantastor import quantastor_argument_spec
-from ansible.module_utils.qs_client import quantastor_sdk_enabled
-from ansible.module_utils.qs_client import QuantastorClient
+from ansible.module_utils.quantastor import (quantastor_argument_spec, quantastor_client, quantastor_directory,
+    quantastor_journal, quantastor_release_pool, quantastor_sdk_enabled, quantastor_select_pool, quantastor_size_in_bytes)
+from ansible.module_utils.parsing.convert_bool import boolean
+import json
+import re
+
+# Tuning settings used when neither a profile nor the parameter specifies a value.
+SHARE_TUNING_DEFAULTS = {
+    'recordSizeKb': '0',
+    'syncPolicy': 'standard',
+    'compressionType': None,
+    'copies': '1',
+    'quotaExcludeSnapshots': True,
+}
+
+# Built-in workload profiles.
+SHARE_PROFILES = {
+    # small random IO matching common database page sizes, writes must be durable
+    'database': {'recordSizeKb': '16', 'syncPolicy': 'always', 'compressionType': 'lz4'},
+    # mid-sized random IO from hypervisors, which issue synchronous writes on behalf of their guests
+    'vm-images': {'recordSizeKb': '64', 'syncPolicy': 'always', 'compressionType': 'lz4'},
+    # large sequential IO of already compressed content
+    'media': {'recordSizeKb': '1024', 'syncPolicy': 'standard', 'compressionType': 'off'},
+    # large sequential writes from backup software which verifies and retries its own jobs
+    'backup-target': {'recordSizeKb': '1024', 'syncPolicy': 'disabled', 'compressionType': 'lz4'},
+    # many small files, keep records small and metadata-heavy workloads compressed
+    'small-file': {'recordSizeKb': '32', 'syncPolicy': 'standard', 'compressionType': 'lz4'},
+}
+SHARE_PROFILES['streaming'] = SHARE_PROFILES['media']
+
+# Loads additional profiles from a YAML or JSON file. PyYAML is only imported here as most runs use no profile file.
+def loadProfileFile(path):
+    with open(path) as f:
+        content = f.read()
+    try:
+        import yaml
+        profiles = yaml.safe_load(content)
+    except ImportError:
+        profiles = json.loads(content)
+    if not isinstance(profiles, dict) or not all(isinstance(value, dict) for value in profiles.values()):
+        raise ValueError("Profile file '%s' must map profile names to dictionaries of settings." % path)
+    return profiles
+
+# Returns the settings of the named profile, following 'extends' references.
+def profileSettings(profiles, name, seen=()):
+    if name not in profiles:
+        raise ValueError("Unknown share profile '%s', valid profiles are: %s." % (name, ', '.join(sorted(profiles))))
+    if name in seen:
+        raise ValueError("Share profile '%s' extends itself." % name)
+    profile = dict(profiles[name])
+    settings = {}
+    if 'extends' in profile:
+        settings.update(profileSettings(profiles, profile.pop('extends'), seen + (name,)))
+    unknown = set(profile) - set(SHARE_TUNING_DEFAULTS)
+    if unknown:
+        raise ValueError("Share profile '%s' has unknown settings '%s', valid settings are: %s." % (name, ','.join(sorted(unknown)), ', '.join(sorted(SHARE_TUNING_DEFAULTS))))
+    settings.update(profile)
+    return settings
+
+# Returns the effective tuning settings: module defaults, overridden by the profile, overridden by explicitly given parameters.
+def resolveShareSettings(params):
+    profiles = dict(SHARE_PROFILES)
+    if params['profileFile']:
+        profiles.update(loadProfileFile(params['profileFile']))
+    settings = dict(SHARE_TUNING_DEFAULTS)
+    if params['profile']:
+        settings.update(profileSettings(profiles, params['profile']))
+    for key in SHARE_TUNING_DEFAULTS:
+        if params[key] is not None:
+            settings[key] = params[key]
+
+    # normalize values coming from profile files
+    for key in ['recordSizeKb', 'copies']:
+        settings[key] = str(settings[key])
+    settings['quotaExcludeSnapshots'] = boolean(settings['quotaExcludeSnapshots'])
+    if settings['syncPolicy'] not in ['standard', 'always', 'disabled']:
+        raise ValueError("Invalid syncPolicy '%s', must be one of: standard, always, disabled." % settings['syncPolicy'])
+    return settings
+
+PERMISSIONS_PATTERN = re.compile(r'^([0-7]{3,4}|[r-][w-][xsS-][r-][w-][xsS-][r-][w-][xtT-])$')
+SMB_OPTION_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9 _.:-]*=.+$')
+ACCESS_ENTRY_PATTERN = re.compile(r'^(~?)(@?)([^@~:,][^:,]*)(?::(valid|invalid|none))?$')
+
+# Owner names that exist on every system without being QuantaStor users or groups
+SYSTEM_OWNERS = ['root']
+
+def isDirectoryName(name):
+    return bool(name) and not name.isdigit() and name not in SYSTEM_OWNERS and '\\' not in name
+
+# Checks the parameters of a new normal share without contacting the system except for one cached user and group listing.
+# Normalizes the quota and reserved space to bytes and returns the list of problems found.
+def validateShareParams(module, client):
+    params = module.params
+    errors = []
+
+    for key in ['quota', 'reservedSpace']:
+        try:
+            params[key] = str(quantastor_size_in_bytes(params[key]))
+        except ValueError as e:
+            errors.append("%s: %s" % (key, str(e)))
+
+    if params['permissions'] and not PERMISSIONS_PATTERN.match(params['permissions']):
+        errors.append("permissions: '%s' is neither in octal (eg. 750) nor in symbolic (eg. rwxr-x---) format." % params['permissions'])
+
+    if params['smbOptionList']:
+        for option in params['smbOptionList'].split(','):
+            if not SMB_OPTION_PATTERN.match(option.strip()):
+                errors.append("smbOptionList: option '%s' is not in the form 'key=value'." % option)
+
+    users = set()
+    groups = set()
+    if params['userAccessList']:
+        for entry in params['userAccessList'].split(','):
+            match = ACCESS_ENTRY_PATTERN.match(entry.strip())
+            if not match or (not match.group(1) and not match.group(4)):
+                errors.append("userAccessList: entry '%s' is not in the form '[~][@]name:valid|invalid|none'." % entry)
+                continue
+            removal, group, name, access = match.groups()
+            if not removal:
+                (groups if group else users).add(name)
+
+    if params['validateDirectory']:
+        if isDirectoryName(params['ownerUser']):
+            users.add(params['ownerUser'])
+        if isDirectoryName(params['ownerGroup']):
+            groups.add(params['ownerGroup'])
+        users = set(name for name in users if isDirectoryName(name))
+        groups = set(name for name in groups if isDirectoryName(name))
+        if users or groups:
+            try:
+                directory = quantastor_directory(module, client)
+            except Exception as e:
+                errors.append("Unable to list the users and groups to validate, error was '%s'." % str(e))
+            else:
+                for name in sorted(users - directory['users']):
+                    errors.append("The user '%s' does not exist." % name)
+                for name in sorted(groups - directory['groups']):
+                    errors.append("The user group '%s' does not exist." % name)
+    return errors
 
 def main():
     argument_spec = quantastor_argument_spec()
@@ -229,23 +432,27 @@ def main():
         share=dict(type='str'),
         shareType=dict(type='str', default='normal', choices=['normal','subshare','alias','snapshot']),
         pool=dict(type='str'),
+        poolCandidates=dict(type='list'),
         ownerUser=dict(type='str'),
         ownerGroup=dict(type='str'),
         description=dict(type='str'),
         quota=dict(type='str', default='0'),
-        recordSizeKb=dict(type='str', default='0'),
+        recordSizeKb=dict(type='str'),
         isActive=dict(type='bool', default=True),
         publicNFS=dict(type='bool', default=True),
         publicSMB=dict(type='bool', default=True),
         permissions=dict(type='str'),
         smbOptionList=dict(type='str'),
         userAccessList=dict(type='str'),
-        syncPolicy=dict(type='str', default='standard', choices=['standard','always','disabled']),
+        syncPolicy=dict(type='str', choices=['standard','always','disabled']),
         compressionType=dict(type='str'),
-        copies=dict(type='str', default='1'),
+        copies=dict(type='str'),
         disableSnapBrowsing=dict(bool='bool'),
-        quotaExcludeSnapshots=dict(type='bool', default=True),
+        quotaExcludeSnapshots=dict(type='bool'),
         reservedSpace=dict(type='str', default='0'),
+        profile=dict(type='str'),
+        profileFile=dict(type='path'),
+        validateDirectory=dict(type='bool', default=True),
         state=dict(type='str', default='present', choices=['present','absent']),
         #share-delete option
         deleteChildren=dict(type='bool', default=False),
@@ -263,11 +470,26 @@ def main():
     if not quantastor_sdk_enabled():
         module.fail_json(msg='QuantaStor python SDK is required for this module.')
 
-    client = QuantastorClient.from_module(module)
+    # Resolve the workload profile into the tuning parameters.
+    try:
+        settings = resolveShareSettings(module.params)
+    except Exception as e:
+        module.fail_json(msg="Failed to resolve share profile '%s', error was '%s'." % (module.params['profile'], str(e)))
+    module.params.update(settings)
+
+    client = quantastor_client(module)
+
+    # Skip all further REST calls if these parameters were already applied and the share has not changed since.
+    journal = quantastor_journal(module, client)
+    if journal and module.params['shareType'] == 'normal' and journal.is_current('share', module.params['share']):
+        if module.params['state'] == 'present':
+            module.exit_json(changed=False, settings=settings)
+        module.exit_json(changed=False)
+
     try:
         client.storage_system_get()
-    except:
-        module.fail_json(msg='Unable to gather QuantaStor system information.')
+    except Exception as e:
+        module.fail_json(msg="Unable to gather QuantaStor system information, error was '%s'." % str(e))
     
     # Operation Variables
     state = module.params['state']
@@ -280,13 +502,19 @@ def main():
     
     if module.params['share']:
         try:
-            client.network_share_get(networkShare=module.params['share'])
+            task, share = client.network_share_get(networkShare=module.params['share'])
             if state == 'present':
                 # If you try to create (present), exit if a share with that name already exists.
+                if shareType == 'normal':
+                    if journal:
+                        journal.record('share', module.params['share'], share)
+                    module.exit_json(changed=False, settings=settings)
                 module.exit_json(changed=False)
         except Exception as e:
             if state == 'absent':
                 # If you try to delete (absent), exit if no share with that name exists.
+                if journal:
+                    journal.record('share', module.params['share'], None)
                 module.exit_json(changed=False)
             else:
                 # case: network share named: module.params['share'] does not already exist and state = 'present'
@@ -304,12 +532,27 @@ def main():
             module.fail_json(msg="To create a(n) '%s', the 'parent' parameter must be a valid network share." % (module.params['shareType']))
 
 
+    # Reject invalid parameters of a new share before making any change
+    if state == 'present' and shareType == 'normal':
+        errors = validateShareParams(module, client)
+        if errors:
+            module.fail_json(msg="Invalid parameters for Network share '%s': %s" % (module.params['share'], ' '.join(errors)), errors=errors)
+
     # For create operations:
+    pool = module.params['pool']
     if state == 'present':
         # normal shares require the 'pool' parameter to be a valid storage pool.
         if not module.params['pool']:
             if shareType == 'normal':
                 module.fail_json(msg="To create a normal share, the 'pool' parameter must be specified.")
+        elif module.params['pool'] == 'auto':
+            if shareType == 'normal':
+                try:
+                    # place by the space the share reserves, or failing that by its quota
+                    size = quantastor_size_in_bytes(module.params['reservedSpace']) or quantastor_size_in_bytes(module.params['quota'])
+                    pool = quantastor_select_pool(module, client, module.params['share'], candidates=module.params['poolCandidates'], size=size)
+                except Exception as e:
+                    module.fail_json(msg="Unable to choose a storage pool for share '%s', error was '%s'." % (module.params['share'], str(e)))
         else:
             try:
                 client.storage_pool_get(module.params['pool'])
@@ -343,6 +586,11 @@ def main():
     else:
         flags = module.params['flags']
 
+    if module.check_mode:
+        if module.params['pool'] == 'auto' and shareType == 'normal' and state == 'present':
+            quantastor_release_pool(module, client, module.params['share'])
+        module.exit_json(changed=True)
+
     #CREATE
     if state == 'present':
         #NORMAL SHARE
@@ -351,7 +599,7 @@ def main():
                 client.network_share_create_ex(
                     name=module.params['share'],
                     description=module.params['description'],
-                    provisionableId=module.params['pool'],
+                    provisionableId=pool,
                     shareOwner=module.params['ownerUser'],
                     shareOwnerGroup=module.params['ownerGroup'],
                     permissions=module.params['permissions'],
@@ -371,7 +619,14 @@ def main():
                     flags=module.params['flags']
                     )
             except Exception as e:
+                if module.params['pool'] == 'auto':
+                    quantastor_release_pool(module, client, module.params['share'])
                 module.fail_json(msg="Failed to create Network share '%s', error was '%s'." % (module.params['share'], str(e)))
+            if journal:
+                journal.refresh('share', module.params['share'])
+            if module.params['pool'] == 'auto':
+                module.exit_json(changed=True, pool=pool, settings=settings)
+            module.exit_json(changed=True, settings=settings)
 
         #SUBSHARE/ALIAS
         elif shareType == 'subshare' or shareType == 'alias':
@@ -410,6 +665,8 @@ def main():
             client.network_share_delete_ex(networkShareList=module.params['share'],flags=flags)
         except Exception as e:
             module.fail_json(msg="Failed to delete Network share '%s', error was '%s'." % (module.params['share'], str(e)))
+        if journal:
+            journal.record('share', module.params['share'], None)
 
         module.exit_json(changed=True)
 
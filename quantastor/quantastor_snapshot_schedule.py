@@ -0,0 +1,420 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2019, OSNEXUS Engineering (eng@osnexus.com)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+module: quantastor_snapshot_schedule
+version_added: '4.6'
+short_description: Manage QuantaStor snapshot schedules
+description:
+- Creates, updates and deletes native QuantaStor snapshot schedules, including their member storage volumes and network shares.
+- The live schedules are read with one enumeration and compared with the requested settings; only schedules that differ are modified.
+- Many schedules can be managed from one task with 'schedules'. Options given at the top level apply to every entry that does not set them.
+- New schedules get a start offset that spreads them across the minutes of the hour, so that many schedules do not fire at the same time.
+author:
+- OSNEXUS Engineering
+options:
+  schedule:
+    description:
+    - Name of the snapshot schedule. Either 'schedule' or 'schedules' must be specified.
+  schedules:
+    description:
+    - List of schedules to manage, each a dictionary with a 'schedule' key and any of the options below.
+  state:
+    description:
+    - Whether the schedule should exist.
+    choices: [ present, absent ]
+    default: present
+  description:
+    description:
+    - Description of the schedule.
+  enabled:
+    description:
+    - Whether the schedule is enabled. New schedules are enabled unless set to false.
+  volumes:
+    description:
+    - Storage volume names or IDs that are snapshotted by the schedule. Volumes not in the list are removed from the schedule.
+      If omitted the volumes of the schedule are left alone.
+  shares:
+    description:
+    - Network share names or IDs that are snapshotted by the schedule. Shares not in the list are removed from the schedule.
+      If omitted the shares of the schedule are left alone.
+  hoursOfDay:
+    description:
+    - List of hours (0-23) at which snapshots are taken.
+  daysOfWeek:
+    description:
+    - List of days (eg. 'mon', 'tue' or 0-6 with 0 being Sunday) on which snapshots are taken. New schedules default to every day.
+  interval:
+    description:
+    - Take snapshots every 'interval' minutes instead of at 'hoursOfDay'.
+  offsetMinutes:
+    description:
+    - Minutes past the hour at which snapshots are taken.
+    - With 'auto' new schedules get the minute used by the fewest other schedules on the system and existing schedules keep their offset.
+    default: auto
+  maxSnapshots:
+    description:
+    - Maximum number of snapshots retained per volume or share. New schedules default to 10.
+  retentionHourly:
+    description:
+    - Number of hourly snapshots retained.
+  retentionDaily:
+    description:
+    - Number of daily snapshots retained.
+  retentionWeekly:
+    description:
+    - Number of weekly snapshots retained.
+  retentionMonthly:
+    description:
+    - Number of monthly snapshots retained.
+  retentionQuarterly:
+    description:
+    - Number of quarterly snapshots retained.
+  concurrency:
+    description:
+    - Maximum number of schedules changed at the same time.
+    default: 8
+  flags:
+    description:
+    - Optional flags for the operation.
+extends_documentation_fragment:
+- quantastor
+'''
+
+EXAMPLES = r'''
+- name: Snapshot two volumes every 4 hours and keep a day's worth
+  quantastor_snapshot_schedule:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    schedule: db-snapshots
+    volumes:
+    - dbvolume
+    - logvolume
+    hoursOfDay: [0, 4, 8, 12, 16, 20]
+    maxSnapshots: 6
+
+- name: Manage the nightly schedules of all tenant shares in one task, removing the schedule of a departed tenant
+  quantastor_snapshot_schedule:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    hoursOfDay: [1]
+    retentionDaily: 7
+    retentionWeekly: 4
+    schedules:
+    - schedule: nightly-tenantA
+      shares: [tenantA]
+    - schedule: nightly-tenantB
+      shares: [tenantB]
+      retentionWeekly: 12
+    - schedule: nightly-tenantC
+      state: absent
+'''
+
+RETURN = r'''
+schedules:
+  description: Per schedule result with the names of the settings that were changed.
+  returned: always
+  type: dict
+  sample: {"db-snapshots": {"changed": true, "failed": false, "msg": "", "action": "modify", "changes": ["maxSnapshots", "volumes"], "offsetMinutes": 17}}
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.quantastor import (quantastor_argument_spec, quantastor_client, quantastor_schedule_masks,
+    quantastor_sdk_enabled, quantastor_spread_offset)
+
+SCHEDULE_TYPE_HOURS = 0
+SCHEDULE_TYPE_INTERVAL = 1
+
+# schedule settings option -> (SnapshotSchedule attribute, snapshotScheduleCreate/Modify parameter)
+SETTINGS = {
+    'description': ('_description', 'description'),
+    'enabled': ('_isEnabled', 'setEnabled'),
+    'maxSnapshots': ('_maxSnapshots', 'maxSnapshots'),
+    'hoursOfDay': ('_hoursOfDay', 'hoursOfDay'),
+    'daysOfWeek': ('_daysOfWeek', 'daysOfWeek'),
+    'scheduleType': ('_scheduleType', 'scheduleType'),
+    'interval': ('_delayInterval', 'delayInterval'),
+    'offsetMinutes': ('_offsetMinutes', 'offsetMinutes'),
+    'retentionHourly': ('_retentionCountHourlies', 'retentionCountHourlies'),
+    'retentionDaily': ('_retentionCountDailies', 'retentionCountDailies'),
+    'retentionWeekly': ('_retentionCountWeeklies', 'retentionCountWeeklies'),
+    'retentionMonthly': ('_retentionCountMonthlies', 'retentionCountMonthlies'),
+    'retentionQuarterly': ('_retentionCountQuarterlies', 'retentionCountQuarterlies'),
+}
+
+# settings of new schedules which were not specified
+CREATE_DEFAULTS = {
+    'description': '',
+    'enabled': '1',
+    'maxSnapshots': '10',
+    'hoursOfDay': '0',
+    'daysOfWeek': str(quantastor_schedule_masks(None, range(7))[1]),
+    'scheduleType': str(SCHEDULE_TYPE_HOURS),
+    'interval': '0',
+    'retentionHourly': '0',
+    'retentionDaily': '0',
+    'retentionWeekly': '0',
+    'retentionMonthly': '0',
+    'retentionQuarterly': '0',
+}
+
+SCHEDULE_OPTIONS = ['state', 'description', 'enabled', 'volumes', 'shares', 'hoursOfDay', 'daysOfWeek', 'interval', 'offsetMinutes',
+                    'maxSnapshots', 'retentionHourly', 'retentionDaily', 'retentionWeekly', 'retentionMonthly', 'retentionQuarterly']
+
+
+def normalize(option, value):
+    if option == 'description':
+        return value or ''
+    if option == 'enabled':
+        return '1' if str(value).lower() in ['1', 'true'] else '0'
+    return str(int(value or 0))
+
+
+def desiredSettings(spec):
+    """Return the normalized settings the spec asks for, leaving out settings it does not specify"""
+
+    settings = {}
+    for option in ['description', 'enabled', 'maxSnapshots', 'retentionHourly', 'retentionDaily', 'retentionWeekly',
+                   'retentionMonthly', 'retentionQuarterly']:
+        if spec.get(option) is not None:
+            settings[option] = normalize(option, spec[option])
+    if spec.get('hoursOfDay') is not None:
+        settings['hoursOfDay'] = str(quantastor_schedule_masks(spec['hoursOfDay'], None)[0])
+        settings['scheduleType'] = str(SCHEDULE_TYPE_HOURS)
+    if spec.get('daysOfWeek') is not None:
+        settings['daysOfWeek'] = str(quantastor_schedule_masks(None, spec['daysOfWeek'])[1])
+    if spec.get('interval'):
+        settings['interval'] = normalize('interval', spec['interval'])
+        settings['scheduleType'] = str(SCHEDULE_TYPE_INTERVAL)
+    if str(spec.get('offsetMinutes', 'auto')) != 'auto':
+        offset = int(spec['offsetMinutes'])
+        if not 0 <= offset <= 59:
+            raise ValueError("Invalid offsetMinutes '%s', must be 'auto' or between 0 and 59." % spec['offsetMinutes'])
+        settings['offsetMinutes'] = str(offset)
+    return settings
+
+
+def liveSettings(schedule):
+    return dict((option, normalize(option, getattr(schedule, attr))) for option, (attr, param) in SETTINGS.items())
+
+
+def apiSettings(settings):
+    return dict((SETTINGS[option][1], value) for option, value in settings.items())
+
+
+def resolveIds(kind, names, byKey):
+    ids = []
+    for name in names:
+        if name not in byKey:
+            raise Exception("The %s '%s' does not exist." % (kind, name))
+        ids.append(byKey[name])
+    return ids
+
+
+def planSchedule(module, client, spec, live, members, volumeIds, shareIds, offsets):
+    """Compare the spec with the live schedule and return the plan of changes for it"""
+
+    name = spec['schedule']
+    plan = dict(name=name, action='none', changes=[], addVolumes=[], addShares=[], removeVolumes=[], removeShares=[])
+    if spec['state'] == 'absent':
+        if live is not None:
+            plan.update(action='delete', id=live._id)
+        return plan
+
+    desired = desiredSettings(spec)
+    wantVolumes = resolveIds('volume', spec['volumes'], volumeIds) if spec.get('volumes') is not None else None
+    wantShares = resolveIds('share', spec['shares'], shareIds) if spec.get('shares') is not None else None
+
+    if live is None:
+        settings = dict(CREATE_DEFAULTS)
+        settings.update(desired)
+        if 'offsetMinutes' not in settings:
+            # every other schedule's offset counts toward the load of its minute
+            settings['offsetMinutes'] = str(quantastor_spread_offset(module, client, name, offsets))
+        plan.update(action='create', settings=settings, changes=sorted(desired), addVolumes=wantVolumes or [], addShares=wantShares or [])
+        plan['offsetMinutes'] = int(settings['offsetMinutes'])
+        return plan
+
+    current = liveSettings(live)
+    changes = sorted(option for option, value in desired.items() if current[option] != value)
+    plan.update(id=live._id, offsetMinutes=int(current['offsetMinutes']))
+    if changes:
+        current.update(desired)
+        plan.update(action='modify', settings=current, changes=changes, offsetMinutes=int(current['offsetMinutes']))
+
+    scheduleMembers = members.get(live._id, set())
+    allVolumeIds = set(volumeIds.values())
+    if wantVolumes is not None:
+        plan['addVolumes'] = sorted(set(wantVolumes) - scheduleMembers)
+        plan['removeVolumes'] = sorted((scheduleMembers & allVolumeIds) - set(wantVolumes))
+    if wantShares is not None:
+        plan['addShares'] = sorted(set(wantShares) - scheduleMembers)
+        plan['removeShares'] = sorted((scheduleMembers - allVolumeIds) - set(wantShares))
+    if plan['addVolumes'] or plan['removeVolumes']:
+        plan['changes'].append('volumes')
+    if plan['addShares'] or plan['removeShares']:
+        plan['changes'].append('shares')
+    if plan['action'] == 'none' and plan['changes']:
+        plan['action'] = 'members'
+    return plan
+
+
+def applyPlan(module, client, plan, live):
+    """Carry out one schedule plan and return its result dictionary"""
+
+    result = dict(changed=plan['action'] != 'none', failed=False, msg='', action=plan['action'], changes=plan['changes'])
+    if 'offsetMinutes' in plan:
+        result['offsetMinutes'] = plan['offsetMinutes']
+    if module.check_mode or plan['action'] == 'none':
+        return result
+    flags = module.params['flags']
+    try:
+        if plan['action'] == 'delete':
+            client.snapshot_schedule_delete(schedule=plan['id'], flags=flags)
+            return result
+        if plan['action'] == 'create':
+            client.snapshot_schedule_create(
+                name=plan['name'],
+                storageVolumeList=','.join(plan['addVolumes']),
+                networkShareList=','.join(plan['addShares']),
+                flags=flags,
+                **apiSettings(plan['settings'])
+                )
+            return result
+        if plan['action'] == 'modify':
+            # pass every current setting, modify resets whatever is not passed
+            client.snapshot_schedule_modify(
+                schedule=plan['id'],
+                name=plan['name'],
+                resourceGroupId=live._resourceGroupId,
+                startDate=live._startDate,
+                enableRecursiveNestedShares=live._enableRecursiveNestedShares,
+                flags=flags,
+                **apiSettings(plan['settings'])
+                )
+        for modType, volumes, shares in [('0', plan['addVolumes'], plan['addShares']), ('1', plan['removeVolumes'], plan['removeShares'])]:
+            if volumes or shares:
+                client.snapshot_schedule_volume_add_remove(
+                    schedule=plan['id'],
+                    modType=modType, #OSN_CMN_MOD_OP_ADD / OSN_CMN_MOD_OP_REMOVE
+                    storageVolumeList=','.join(volumes),
+                    networkShareList=','.join(shares),
+                    flags=flags
+                    )
+    except Exception as e:
+        result['failed'] = True
+        result['msg'] = "Failed to %s snapshot schedule '%s', error was '%s'." % (plan['action'], plan['name'], str(e))
+    return result
+
+
+def main():
+    argument_spec = quantastor_argument_spec()
+    argument_spec.update(dict(
+        schedule=dict(type='str'),
+        schedules=dict(type='list', elements='dict'),
+        state=dict(type='str', default='present', choices=['present', 'absent']),
+        description=dict(type='str'),
+        enabled=dict(type='bool'),
+        volumes=dict(type='list'),
+        shares=dict(type='list'),
+        hoursOfDay=dict(type='list'),
+        daysOfWeek=dict(type='list'),
+        interval=dict(type='int'),
+        offsetMinutes=dict(type='str', default='auto'),
+        maxSnapshots=dict(type='int'),
+        retentionHourly=dict(type='int'),
+        retentionDaily=dict(type='int'),
+        retentionWeekly=dict(type='int'),
+        retentionMonthly=dict(type='int'),
+        retentionQuarterly=dict(type='int'),
+        concurrency=dict(type='int', default=8),
+        flags=dict(type='int', default=0),
+    ))
+
+    # System checks
+    module = AnsibleModule(argument_spec, supports_check_mode=True, mutually_exclusive=[['schedule', 'schedules']],
+                           required_one_of=[['schedule', 'schedules']])
+    if not quantastor_sdk_enabled():
+        module.fail_json(msg='QuantaStor python SDK is required for this module.')
+
+    # Build one spec per schedule from the top level options and the entry's own options
+    specs = []
+    for entry in module.params['schedules'] or [dict(schedule=module.params['schedule'])]:
+        unknown = set(entry) - set(SCHEDULE_OPTIONS) - set(['schedule'])
+        if unknown:
+            module.fail_json(msg="Unsupported schedule options '%s', valid options are: %s." % (','.join(sorted(unknown)), ', '.join(SCHEDULE_OPTIONS)))
+        if not entry.get('schedule'):
+            module.fail_json(msg="Every entry of 'schedules' must specify a 'schedule' name.")
+        spec = dict((option, module.params[option]) for option in SCHEDULE_OPTIONS)
+        spec.update(entry)
+        if spec['state'] not in ['present', 'absent']:
+            module.fail_json(msg="Invalid state '%s' for schedule '%s'." % (spec['state'], spec['schedule']))
+        specs.append(spec)
+
+    client = quantastor_client(module)
+
+    # One enumeration of schedules, memberships, volumes and shares covers every schedule of the task
+    try:
+        task, schedules = client.snapshot_schedule_enum()
+        live = {}
+        for schedule in schedules:
+            live[schedule._id] = schedule
+            live[schedule._name] = schedule
+        members = {}
+        volumeIds = {}
+        shareIds = {}
+        if any(spec.get('volumes') is not None or spec.get('shares') is not None for spec in specs):
+            for assoc in client.snapshot_schedule_assoc_enum():
+                members.setdefault(assoc._snapshotScheduleId, set()).add(assoc._storageVolumeId)
+            for volume in client.storage_volume_enum():
+                volumeIds[volume._id] = volume._id
+                volumeIds[volume._name] = volume._id
+        if any(spec.get('shares') is not None for spec in specs):
+            task, shares = client.network_share_enum()
+            for share in shares:
+                shareIds[share._id] = share._id
+                shareIds[share._name] = share._id
+    except Exception as e:
+        module.fail_json(msg="Unable to gather snapshot schedule information, error was '%s'." % str(e))
+
+    # Plan serially so that new schedules of this task are spread across each other as well
+    plans = []
+    for spec in specs:
+        schedule = live.get(spec['schedule'])
+        offsets = [int(s._offsetMinutes or 0) for s in schedules if schedule is None or s._id != schedule._id]
+        try:
+            plans.append((planSchedule(module, client, spec, schedule, members, volumeIds, shareIds, offsets), schedule))
+        except Exception as e:
+            module.fail_json(msg="Invalid settings for snapshot schedule '%s', error was '%s'." % (spec['schedule'], str(e)))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, module.params['concurrency']))
+    try:
+        futures = [(plan['name'], executor.submit(applyPlan, module, client, plan, schedule)) for plan, schedule in plans]
+        results = dict((name, future.result()) for name, future in futures)
+    finally:
+        executor.shutdown(wait=True)
+
+    failed = [name for name, result in results.items() if result['failed']]
+    changed = any(result['changed'] and not result['failed'] for result in results.values())
+    if failed:
+        module.fail_json(msg="Failed to update %d of %d snapshot schedules: %s." % (len(failed), len(results), ', '.join(sorted(failed))),
+                         changed=changed, schedules=results)
+    module.exit_json(changed=changed, schedules=results)
+
+
+if __name__ == '__main__':
+    main()
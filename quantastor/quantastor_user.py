@@ -0,0 +1,420 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2019, OSNEXUS Engineering (eng@osnexus.com)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+module: quantastor_user
+version_added: '4.6'
+short_description: Manage QuantaStor users, user groups and group memberships in bulk
+description:
+- Creates, updates and deletes lists of users and user groups and the memberships of users in groups.
+- Users, groups, memberships and roles are read with one enumeration each and compared with the lists; only the differences are
+  applied, with up to 'concurrency' REST calls at the same time.
+- Users are created before groups, so new groups can list new users as members.
+author:
+- OSNEXUS Engineering
+options:
+  users:
+    description:
+    - List of users.
+    suboptions:
+      name:
+        description:
+        - User name.
+        required: true
+      state:
+        description:
+        - Whether the user should exist.
+        choices: [ present, absent ]
+        default: present
+      password:
+        description:
+        - Password of the user. Required to create a user.
+      role:
+        description:
+        - Name or ID of the user's role, eg. 'Storage User'. Required to create a user.
+      firstName:
+        description:
+        - First name of the user.
+      lastName:
+        description:
+        - Last name of the user.
+      emailAddress:
+        description:
+        - Email address of the user.
+      description:
+        description:
+        - Description of the user.
+      posixUid:
+        description:
+        - POSIX user ID of the user.
+      groups:
+        description:
+        - Groups the user is added to. Memberships in other groups are left alone.
+  groups:
+    description:
+    - List of user groups.
+    suboptions:
+      name:
+        description:
+        - Group name.
+        required: true
+      state:
+        description:
+        - Whether the group should exist.
+        choices: [ present, absent ]
+        default: present
+      description:
+        description:
+        - Description of the group.
+      posixGid:
+        description:
+        - POSIX group ID of the group.
+      members:
+        description:
+        - Users that are members of the group. Members not in the list (nor naming the group in their 'groups') are removed from
+          the group. If omitted the members of the group are left alone.
+  updatePassword:
+    description:
+    - With 'on_create' passwords are only set on new users. With 'always' the password of every listed user is set, which always reports a change.
+    choices: [ always, on_create ]
+    default: on_create
+  concurrency:
+    description:
+    - Maximum number of REST calls made at the same time.
+    default: 8
+  flags:
+    description:
+    - Optional flags for the operation.
+extends_documentation_fragment:
+- quantastor
+'''
+
+EXAMPLES = r'''
+- name: Onboard the engineering department and its share group
+  quantastor_user:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    users: "{{ engineering_users }}"
+    groups:
+    - name: engineering
+      description: Engineering department
+      members: "{{ engineering_users | map(attribute='name') | list }}"
+
+- name: Create the group used by the test playbooks
+  quantastor_user:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    groups:
+    - name: testGroup
+
+- name: Remove a user who left
+  quantastor_user:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    users:
+    - name: jdoe
+      state: absent
+'''
+
+RETURN = r'''
+users:
+  description: Per user result with the action taken and the names of the changed settings.
+  returned: always
+  type: dict
+  sample: {"jdoe": {"changed": true, "failed": false, "msg": "", "action": "modify", "changes": ["emailAddress"]}}
+groups:
+  description: Per group result with the action taken, the names of the changed settings and the added and removed members.
+  returned: always
+  type: dict
+  sample: {"engineering": {"changed": true, "failed": false, "msg": "", "action": "members", "changes": [], "added": ["jdoe"], "removed": []}}
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.quantastor import quantastor_argument_spec, quantastor_client, quantastor_sdk_enabled
+
+# user option -> User attribute
+USER_SETTINGS = {
+    'role': '_roleId',
+    'firstName': '_firstName',
+    'lastName': '_lastName',
+    'emailAddress': '_emailAddress',
+    'description': '_description',
+    'posixUid': '_posixUid',
+}
+
+# group option -> UserGroup attribute
+GROUP_SETTINGS = {
+    'description': '_description',
+    'posixGid': '_posixGid',
+}
+
+
+def settingChanges(spec, obj, settings, roleIds=None):
+    """Return the names of the settings in spec which differ from the object"""
+
+    changes = []
+    for option, attr in settings.items():
+        if spec.get(option) is None:
+            continue
+        wanted = str(spec[option])
+        if option == 'role':
+            wanted = roleIds.get(wanted, wanted)
+        if wanted != str(getattr(obj, attr)):
+            changes.append(option)
+    return sorted(changes)
+
+
+def applyAll(module, function, items):
+    """Call function(item) for each item with up to 'concurrency' calls at once and return the results in order"""
+
+    executor = ThreadPoolExecutor(max_workers=max(1, module.params['concurrency']))
+    try:
+        return [future.result() for future in [executor.submit(function, item) for item in items]]
+    finally:
+        executor.shutdown(wait=True)
+
+
+def applyUser(module, client, plan):
+    spec, user = plan['spec'], plan['obj']
+    result = dict(changed=plan['action'] != 'none', failed=False, msg='', action=plan['action'], changes=plan['changes'])
+    if module.check_mode or plan['action'] == 'none':
+        return result
+    try:
+        if plan['action'] == 'create':
+            client.user_add(
+                username=spec['name'],
+                password=spec['password'],
+                role=spec['role'],
+                firstName=spec['firstName'] or '',
+                lastName=spec['lastName'] or '',
+                emailAddress=spec['emailAddress'] or '',
+                description=spec['description'] or '',
+                posixUid=str(spec['posixUid'] or 0),
+                flags=module.params['flags']
+                )
+        elif plan['action'] == 'delete':
+            client.user_remove(user=user._id, flags=module.params['flags'])
+        else:
+            if [change for change in plan['changes'] if change != 'password']:
+                def value(option):
+                    return spec[option] if spec.get(option) is not None else getattr(user, USER_SETTINGS[option])
+                # pass every current setting, modify resets whatever is not passed
+                client.user_modify(
+                    user=user._id,
+                    newName=user._name,
+                    newRole=value('role'),
+                    newFirstName=value('firstName'),
+                    newLastName=value('lastName'),
+                    newEmailAddress=value('emailAddress'),
+                    newDescription=value('description'),
+                    newDefaultChapUsername=user._defaultChapUsername,
+                    newDefaultChapPassword=user._defaultChapPassword,
+                    alertSubscriptions=user._alertSubscriptions,
+                    posixUid=str(value('posixUid')),
+                    posixGid=user._posixGid,
+                    lockAccount=user._isLocked,
+                    allowRootCliTokenAuth=user._allowRootCliTokenAuth,
+                    wuiTabDisable=user._wuiTabDisable,
+                    wuiSectionDisable=user._wuiSectionDisable,
+                    enableMultiFactorAuth=user._enableMultiFactorAuth,
+                    multiFactorAuthConfig=user._multiFactorAuthConfigId,
+                    flags=module.params['flags']
+                    )
+            if 'password' in plan['changes']:
+                client.user_password_set(user=user._id, newPassword=spec['password'], flags=module.params['flags'])
+    except Exception as e:
+        result['failed'] = True
+        result['msg'] = "Failed to %s user '%s', error was '%s'." % (plan['action'], spec['name'], str(e))
+    return result
+
+
+def applyGroup(module, client, plan):
+    spec, group = plan['spec'], plan['obj']
+    result = dict(changed=plan['action'] != 'none', failed=False, msg='', action=plan['action'], changes=plan['changes'],
+                  added=plan['added'], removed=plan['removed'])
+    if module.check_mode or plan['action'] == 'none':
+        return result
+    try:
+        if plan['action'] == 'create':
+            client.user_group_create(
+                name=spec['name'],
+                description=spec['description'] or '',
+                userList=','.join(plan['added']),
+                posixGid=str(spec['posixGid'] or 0),
+                flags=module.params['flags']
+                )
+        elif plan['action'] == 'delete':
+            client.user_group_delete(userGroup=group._id, flags=module.params['flags'])
+        else:
+            if plan['changes']:
+                client.user_group_modify(
+                    userGroup=group._id,
+                    newName=group._name,
+                    newDescription=spec['description'] if spec['description'] is not None else group._description,
+                    posixGid=str(spec['posixGid'] if spec['posixGid'] is not None else group._posixGid),
+                    flags=module.params['flags']
+                    )
+            for modType, users in [('0', plan['added']), ('1', plan['removed'])]:
+                if users:
+                    client.user_group_user_add_remove(
+                        userGroup=group._id,
+                        modType=modType, #OSN_CMN_MOD_OP_ADD / OSN_CMN_MOD_OP_REMOVE
+                        userList=','.join(users),
+                        flags=module.params['flags']
+                        )
+    except Exception as e:
+        result['failed'] = True
+        result['msg'] = "Failed to %s user group '%s', error was '%s'." % (plan['action'], spec['name'], str(e))
+    return result
+
+
+def main():
+    argument_spec = quantastor_argument_spec()
+    argument_spec.update(dict(
+        users=dict(type='list', elements='dict', default=[], options=dict(
+            name=dict(type='str', required=True),
+            state=dict(type='str', default='present', choices=['present', 'absent']),
+            password=dict(type='str', no_log=True),
+            role=dict(type='str'),
+            firstName=dict(type='str'),
+            lastName=dict(type='str'),
+            emailAddress=dict(type='str'),
+            description=dict(type='str'),
+            posixUid=dict(type='int'),
+            groups=dict(type='list', default=[]),
+        )),
+        groups=dict(type='list', elements='dict', default=[], options=dict(
+            name=dict(type='str', required=True),
+            state=dict(type='str', default='present', choices=['present', 'absent']),
+            description=dict(type='str'),
+            posixGid=dict(type='int'),
+            members=dict(type='list'),
+        )),
+        updatePassword=dict(type='str', default='on_create', choices=['always', 'on_create'], no_log=False),
+        concurrency=dict(type='int', default=8),
+        flags=dict(type='int', default=0),
+    ))
+
+    # System checks
+    module = AnsibleModule(argument_spec, supports_check_mode=True)
+    if not quantastor_sdk_enabled():
+        module.fail_json(msg='QuantaStor python SDK is required for this module.')
+
+    client = quantastor_client(module)
+
+    # One enumeration each of users, groups, memberships and roles covers the whole task
+    try:
+        task, users = client.user_enum()
+        task, groups = client.user_group_enum()
+        assocs = client.user_group_assoc_enum() if module.params['groups'] or any(u['groups'] for u in module.params['users']) else []
+        roleIds = {}
+        if any(u['role'] for u in module.params['users']):
+            task, roles = client.role_enum()
+            for role in roles:
+                roleIds[role._name] = role._id
+                roleIds[role._id] = role._id
+    except Exception as e:
+        module.fail_json(msg="Unable to gather user information, error was '%s'." % str(e))
+
+    usersByName = dict((user._name, user) for user in users)
+    groupsByName = dict((group._name, group) for group in groups)
+    userNames = dict((user._id, user._name) for user in users)
+    members = {}
+    for assoc in assocs:
+        members.setdefault(assoc._userGroupId, set()).add(userNames.get(assoc._userId, assoc._userId))
+
+    # Plan the user changes
+    userPlans = []
+    for spec in module.params['users']:
+        user = usersByName.get(spec['name'])
+        plan = dict(spec=spec, obj=user, action='none', changes=[])
+        if spec['state'] == 'absent':
+            if user is not None:
+                plan['action'] = 'delete'
+        elif user is None:
+            if not spec['password'] or not spec['role']:
+                module.fail_json(msg="To create user '%s', the 'password' and 'role' must be specified." % spec['name'])
+            plan['action'] = 'create'
+        else:
+            plan['changes'] = settingChanges(spec, user, USER_SETTINGS, roleIds)
+            if spec['password'] and module.params['updatePassword'] == 'always':
+                plan['changes'].append('password')
+            if plan['changes']:
+                plan['action'] = 'modify'
+        userPlans.append(plan)
+
+    # Plan the group changes; users naming a group in 'groups' are added to its members
+    joining = {}
+    for spec in module.params['users']:
+        if spec['state'] == 'present':
+            for groupName in spec['groups']:
+                joining.setdefault(groupName, set()).add(spec['name'])
+    leaving = set(spec['name'] for spec in module.params['users'] if spec['state'] == 'absent')
+    groupSpecs = dict((spec['name'], spec) for spec in module.params['groups'])
+    for groupName in joining:
+        if groupName not in groupSpecs:
+            if groupName not in groupsByName:
+                module.fail_json(msg="The user group '%s' does not exist." % groupName)
+            groupSpecs[groupName] = dict(name=groupName, state='present', description=None, posixGid=None, members=None)
+
+    groupPlans = []
+    for spec in groupSpecs.values():
+        group = groupsByName.get(spec['name'])
+        plan = dict(spec=spec, obj=group, action='none', changes=[], added=[], removed=[])
+        if spec['state'] == 'absent':
+            if group is not None:
+                plan['action'] = 'delete'
+            groupPlans.append(plan)
+            continue
+        current = members.get(group._id, set()) if group is not None else set()
+        wanted = set(joining.get(spec['name'], set()))
+        if spec['members'] is not None:
+            wanted |= set(spec['members'])
+        else:
+            # leave the current members alone, but removed users no longer count as members
+            wanted |= current - leaving
+        plan['added'] = sorted(wanted - current)
+        plan['removed'] = sorted(current - wanted - leaving)
+        if group is None:
+            plan['action'] = 'create'
+        else:
+            plan['changes'] = settingChanges(spec, group, GROUP_SETTINGS)
+            if plan['changes']:
+                plan['action'] = 'modify'
+            elif plan['added'] or plan['removed']:
+                plan['action'] = 'members'
+        groupPlans.append(plan)
+
+    # Users first, so that new groups can reference them
+    userResults = applyAll(module, lambda plan: applyUser(module, client, plan), userPlans)
+    groupResults = applyAll(module, lambda plan: applyGroup(module, client, plan), groupPlans)
+
+    result = dict(
+        users=dict((plan['spec']['name'], r) for plan, r in zip(userPlans, userResults)),
+        groups=dict((plan['spec']['name'], r) for plan, r in zip(groupPlans, groupResults)),
+    )
+    results = list(result['users'].values()) + list(result['groups'].values())
+    result['changed'] = any(r['changed'] and not r['failed'] for r in results)
+    failed = [r['msg'] for r in results if r['failed']]
+    if failed:
+        module.fail_json(msg="%d of %d user and group changes failed: %s" % (len(failed), len(results), ' '.join(failed)), **result)
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -30,12 +30,41 @@ options:
   size:
     description:
     - size of the volume to be created in MB
+  pool:
+    description:
+    - Name or ID of the storage pool for a new normal volume. Set to 'auto' to have a pool chosen based on free space and the
+      placements recently made on each pool and storage system, so that a batch of new volumes is spread across pools and nodes.
+  poolCandidates:
+    description:
+    - With 'pool: auto', list of pool names (shell-style wildcards allowed) or IDs to choose from. Defaults to all pools.
   state:
     description:
     - Creates (present) or deletes (absent) a storage volume
     default: present
     choices: [ absent, present ]
 
+QoS options:
+  qosReadIops:
+    description:
+    - Maximum read IOPS for the volume, 0 for unlimited.
+  qosWriteIops:
+    description:
+    - Maximum write IOPS for the volume, 0 for unlimited.
+  qosReadBandwidth:
+    description:
+    - Maximum read bandwidth per second for the volume (eg. 200MB or 1GiB), 0 for unlimited.
+  qosWriteBandwidth:
+    description:
+    - Maximum write bandwidth per second for the volume (eg. 200MB or 1GiB), 0 for unlimited.
+  qosPolicy:
+    description:
+    - Name or ID of a QoS policy to apply instead of per-volume limits. If any of the qos* limits are given as well, the policy is
+      created with (or updated to) those limits first.
+  volumes:
+    description:
+    - List of existing storage volumes to apply the QoS limits or QoS policy to in one task. The current limits of all volumes are read
+      with one enumeration and only volumes whose limits differ are modified.
+
 Volume-Delete options:
   deleteChildren:
     description:
@@ -75,6 +104,37 @@ EXAMPLES = r'''
     pool: DefaultPool
     size: 1024
 
+- name: Create 20 volumes spread across the storage pools whose names start with "ssd-"
+  quantastor_volume:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    volume: "vol{{ item }}"
+    pool: auto
+    poolCandidates:
+    - ssd-*
+    size: 100GB
+  loop: "{{ range(20) | list }}"
+
+- name: Limit volumeA to 5000 read and 2000 write IOPS
+  quantastor_volume:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    volume: volumeA
+    qosReadIops: 5000
+    qosWriteIops: 2000
+
+- name: Apply the "tenant-bronze" QoS policy (200 MB/s each way) to many volumes
+  quantastor_volume:
+    quantastor_hostname: 10.10.10.2
+    quantastor_username: admin
+    quantastor_password: password
+    volumes: "{{ bronze_volumes }}"
+    qosPolicy: tenant-bronze
+    qosReadBandwidth: 200MB
+    qosWriteBandwidth: 200MB
+
 - name: Create a snapshot of volumeA called snapA
   quantastor_volume: 
     quantastor_hostname: 10.10.10.2
@@ -105,15 +165,110 @@ EXAMPLES = r'''
 '''
 
 RETURN = r'''
+pool:
+  description: Name of the storage pool chosen for a new volume when 'pool' is set to 'auto'.
+  returned: when a volume was created with 'pool: auto'
+  type: str
+qosChanged:
+  description: Names of the volumes whose QoS limits or QoS policy were changed.
+  returned: when QoS options were given
+  type: list
+qosPolicyChanged:
+  description: Whether the QoS policy named by 'qosPolicy' was created or its limits were updated.
+  returned: when QoS options were given
+  type: bool
 '''
 
 from ansible.module_utils.basic import AnsibleModule
-from os import environ
-import requests
-from requests.auth import HTTPBasicAuth
-from ansible.module_utils.quantastor import quantastor_argument_spec
-from ansible.module_utils.qs_client import quantastor_sdk_enabled
-from ansible.module_utils.qs_client import QuantastorClient
+from ansible.module_utils.quantastor import (quantastor_argument_spec, quantastor_client, quantastor_journal,
+    quantastor_release_pool, quantastor_sdk_enabled, quantastor_select_pool, quantastor_size_in_bytes)
+from concurrent.futures import ThreadPoolExecutor
+
+QOS_LIMITS = ['qosReadIops', 'qosWriteIops', 'qosReadBandwidth', 'qosWriteBandwidth']
+
+# Returns the QoS limits given in the module parameters, converted to IOPS and bytes per second.
+def qosLimits(params):
+    return dict((limit, quantastor_size_in_bytes(params[limit])) for limit in QOS_LIMITS if params[limit] is not None)
+
+# Returns QoS limits as the string arguments expected by QuantastorClient.
+def qosArgs(limits):
+    return dict((limit, str(value)) for limit, value in limits.items())
+
+# Returns true if any of the QoS parameters were given.
+def qosRequested(params):
+    return bool(params['qosPolicy']) or any(params[limit] is not None for limit in QOS_LIMITS)
+
+# Returns the QoS policy named by the 'qosPolicy' parameter, creating or updating it first if QoS limits were also given,
+# and whether the policy was (or in check mode would be) created or updated. The policy is None in check mode if it would
+# have to be created.
+def ensureQosPolicy(client, module):
+    limits = qosLimits(module.params)
+    policy = None
+    for entry in client.qos_policy_enum():
+        if module.params['qosPolicy'] in (entry._name, entry._id):
+            policy = entry
+    if policy is None:
+        if not limits:
+            module.fail_json(msg="QoS policy '%s' does not exist, specify the qos* limits to create it." % module.params['qosPolicy'])
+        if module.check_mode:
+            return None, True
+        task, policy = client.qos_policy_create(name=module.params['qosPolicy'], **qosArgs(limits))
+        return policy, True
+    if any(int(getattr(policy, '_' + limit) or 0) != value for limit, value in limits.items()):
+        if not module.check_mode:
+            current = dict((limit, int(getattr(policy, '_' + limit) or 0)) for limit in QOS_LIMITS)
+            current.update(limits)
+            task, policy = client.qos_policy_modify(qosPolicy=policy._id, name=policy._name, description=policy._description, **qosArgs(current))
+        return policy, True
+    return policy, False
+
+# Applies the QoS limits or QoS policy given in the module parameters to the named volumes, touching only volumes whose
+# current settings differ. 'current' maps volume names to already fetched volume objects; otherwise all volumes are
+# read with one enumeration. Returns the names of the changed volumes and whether the QoS policy was created or updated.
+def applyQos(client, module, names, current=None):
+    policy = None
+    policyChanged = False
+    if module.params['qosPolicy']:
+        policy, policyChanged = ensureQosPolicy(client, module)
+    if current is None:
+        current = {}
+        for volume in client.storage_volume_enum():
+            current[volume._name] = volume
+            current[volume._id] = volume
+
+    missing = [name for name in names if name not in current]
+    if missing:
+        module.fail_json(msg="Cannot apply QoS settings, storage volume(s) '%s' do not exist." % ','.join(missing))
+
+    limits = qosLimits(module.params)
+    changes = []
+    for name in names:
+        volume = current[name]
+        if module.params['qosPolicy']:
+            if policy is None or volume._qosPolicyId != policy._id:
+                changes.append(name)
+        elif volume._qosPolicyId or any(int(getattr(volume, '_' + limit) or 0) != value for limit, value in limits.items()):
+            changes.append(name)
+
+    def setQos(name):
+        if module.params['qosPolicy']:
+            client.storage_volume_set_qos_controls(storageVolume=current[name]._id, qosPolicy=policy._id)
+        else:
+            volumeLimits = dict((limit, int(getattr(current[name], '_' + limit) or 0)) for limit in QOS_LIMITS)
+            volumeLimits.update(limits)
+            client.storage_volume_set_qos_controls(storageVolume=current[name]._id, **qosArgs(volumeLimits))
+
+    if changes and not module.check_mode:
+        executor = ThreadPoolExecutor(max_workers=max(1, module.params['quantastor_max_inflight']))
+        try:
+            for name, future in [(name, executor.submit(setQos, name)) for name in changes]:
+                try:
+                    future.result()
+                except Exception as e:
+                    module.fail_json(msg="Failed to set QoS controls for storage volume '%s', error was '%s'." % (name, str(e)))
+        finally:
+            executor.shutdown(wait=True)
+    return changes, policyChanged
 
 def main():
     argument_spec = quantastor_argument_spec()
@@ -121,6 +276,7 @@ def main():
         volume=dict(type='str'),
         parent=dict(type='str'),
         pool=dict(type='str'),
+        poolCandidates=dict(type='list'),
         size=dict(type='str'),
         description=dict(type='str'),
         accessMode=dict(type='str'),
@@ -129,6 +285,13 @@ def main():
         volumeType=dict(type='str', default='normal', choices=['normal','snapshot','clone']),
         #delete option
         deleteChildren=dict(type='bool', default=False),
+        #qos options
+        qosReadIops=dict(type='str'),
+        qosWriteIops=dict(type='str'),
+        qosReadBandwidth=dict(type='str'),
+        qosWriteBandwidth=dict(type='str'),
+        qosPolicy=dict(type='str'),
+        volumes=dict(type='list'),
         flags=dict(type='int', default=0),
     ))
 
@@ -137,35 +300,70 @@ def main():
     if not quantastor_sdk_enabled():
         module.fail_json(msg='QuantaStor python SDK is required for this module.')
 
-    client = QuantastorClient.from_module(module)
+    client = quantastor_client(module)
+
+    # Skip all further REST calls if these parameters were already applied and the volume has not changed since.
+    journal = quantastor_journal(module, client)
+    if journal and module.params['volumeType'] == 'normal' and journal.is_current('volume', module.params['volume']):
+        module.exit_json(changed=False)
+
     try:
         client.storage_system_get("")
-    except:
-        module.fail_json(msg='Unable to gather QuantaStor system information.')
+    except Exception as e:
+        module.fail_json(msg="Unable to gather QuantaStor system information, error was '%s'." % str(e))
 
     # Operational Variables
     state = module.params['state']
     volumeType = module.params['volumeType']
 
+    # Bulk QoS mode: apply the QoS settings to a list of existing volumes.
+    if module.params['volumes']:
+        if not qosRequested(module.params) or state != 'present':
+            module.fail_json(msg="The 'volumes' parameter may only be used together with the QoS parameters and state 'present'.")
+        try:
+            changes, policyChanged = applyQos(client, module, module.params['volumes'])
+        except Exception as e:
+            module.fail_json(msg="Failed to apply QoS settings, error was '%s'." % str(e))
+        module.exit_json(changed=len(changes) > 0 or policyChanged, qosChanged=changes, qosPolicyChanged=policyChanged)
+
     # Bailout checks
     # all non-'snapshot' volume types require 'volume' parameter.
     if not module.params['volume'] and not volumeType == 'snapshot':
         module.fail_json(msg="To create/delete a '%s', the 'volume' parameter must be specified." % (module.params['volumeType']))
     
     if module.params['volume']:
+        volume = None
         try:
-            client.storage_volume_get(storageVolume=module.params['volume'])
-            if state == 'present':
-                # If you try to create (present), exit if a volume with that name already exists.
-                module.exit_json(changed=False)
+            volume = client.storage_volume_get(storageVolume=module.params['volume'])
         except Exception as e:
             if state == 'absent':
                 # If you try to delete (absent), exit if no volume with that name exists.
+                if journal:
+                    journal.record('volume', module.params['volume'], None)
                 module.exit_json(changed=False)
             else:
                 # case: storage volume named: module.params['volume'] does not already exist and state = 'present'
                 pass
 
+        if volume and state == 'present':
+            # If you try to create (present), exit if a volume with that name already exists.
+            # The QoS settings are the only settings applied to an existing volume.
+            changes = []
+            policyChanged = False
+            if qosRequested(module.params):
+                try:
+                    changes, policyChanged = applyQos(client, module, [module.params['volume']], {module.params['volume']: volume})
+                except Exception as e:
+                    module.fail_json(msg="Failed to apply QoS settings to storage volume '%s', error was '%s'." % (module.params['volume'], str(e)))
+            if journal and volumeType == 'normal':
+                if changes:
+                    journal.refresh('volume', module.params['volume'])
+                else:
+                    journal.record('volume', module.params['volume'], volume)
+            if qosRequested(module.params):
+                module.exit_json(changed=len(changes) > 0 or policyChanged, qosChanged=changes, qosPolicyChanged=policyChanged)
+            module.exit_json(changed=False)
+
     if not module.params['parent']:
         if not volumeType == 'normal':
             # all non-'normal' volume types require 'parent' parameter.
@@ -184,11 +382,20 @@ def main():
 
     
     # For create operations:
+    pool = module.params['pool']
     if state == 'present':
         # normal volumes require the 'pool' parameter to be a valid storage pool.
         if not module.params['pool']:
             if volumeType == 'normal':
                 module.fail_json(msg="To create a normal volume, the 'pool' parameter must be specified.")
+        elif module.params['pool'] == 'auto':
+            if volumeType == 'normal':
+                try:
+                    pool = quantastor_select_pool(module, client, module.params['volume'],
+                        candidates=module.params['poolCandidates'],
+                        size=quantastor_size_in_bytes(module.params['size'], 1024*1024))
+                except Exception as e:
+                    module.fail_json(msg="Unable to choose a storage pool for volume '%s', error was '%s'." % (module.params['volume'], str(e)))
         else:
             try:
                 client.storage_pool_get(module.params['pool'])
@@ -215,10 +422,22 @@ def main():
                             name=module.params['volume'],
                             size=module.params['size'], 
                             description=module.params['description'], 
-                            provisionableId=module.params['pool']
+                            provisionableId=pool
                             )
             except Exception as e: 
+                if module.params['pool'] == 'auto':
+                    quantastor_release_pool(module, client, module.params['volume'])
                 module.fail_json(msg="Failed to create storage volume '%s', error was '%s'." % (module.params['volume'], str(e)))
+            if qosRequested(module.params) and not module.check_mode:
+                try:
+                    applyQos(client, module, [module.params['volume']],
+                        {module.params['volume']: client.storage_volume_get(storageVolume=module.params['volume'])})
+                except Exception as e:
+                    module.fail_json(msg="Created storage volume '%s' but failed to apply its QoS settings, error was '%s'." % (module.params['volume'], str(e)))
+            if journal:
+                journal.refresh('volume', module.params['volume'])
+            if module.params['pool'] == 'auto':
+                module.exit_json(changed=True, pool=pool)
 
         #SNAPSHOT
         elif volumeType == 'snapshot':
@@ -247,6 +466,8 @@ def main():
             client.storage_volume_delete(storageVolumeList=module.params['volume'],flags=flags)
         except Exception as e: 
             module.fail_json(msg="Failed to delete storage volume '%s', error was '%s'." % (module.params['volume'], str(e)))
+        if journal:
+            journal.record('volume', module.params['volume'], None)
         
         # Verify Deletion
         module.exit_json(changed=True)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) 2019, OSNEXUS Engineering (eng@osnexus.com)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Placement check for 'pool: auto' in the QuantaStor ansible modules.
+
+Creates a batch of volumes with 'pool: auto' against the local REST stand-in of tools/qs_scale.py, whose synthetic grid
+has pools with 1/2, 1/3, 1/4 and 1/5 of their space free on two storage systems, and prints how many volumes each pool
+received. The volumes are created by separate module runs, optionally several at once with '--forks', so the shared
+placement ledger is exercised the way a playbook with many forks does. Exits with 1 if the batch did not spread, that
+is if one pool received more than half of the volumes.
+
+Examples:
+
+    python tools/qs_placement.py
+    python tools/qs_placement.py --count 40 --forks 8
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qs_scale import MODULE_DIR, QuantastorStandIn, makeCertificate, serve
+
+
+def createVolume(workDir, args):
+    """Run quantastor_volume once and return the name of the pool it placed the volume in"""
+
+    argsFile = os.path.join(workDir, args['volume'] + '.json')
+    with open(argsFile, 'w') as f:
+        json.dump({'ANSIBLE_MODULE_ARGS': args}, f)
+    process = subprocess.run([sys.executable, os.path.join(MODULE_DIR, 'quantastor_volume.py'), argsFile],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    lines = [line for line in process.stdout.splitlines() if line.startswith('{')]
+    result = json.loads(lines[-1]) if lines else {}
+    if not result.get('pool'):
+        raise Exception("quantastor_volume did not place volume '%s': %s" % (args['volume'], (process.stdout + process.stderr)[-2000:]))
+    return result['pool']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=8, help='number of volumes to create')
+    parser.add_argument('--forks', type=int, default=1, help='number of module runs at the same time')
+    parser.add_argument('--size', default='1GB', help='size of every volume')
+    options = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix='qs_placement')
+    try:
+        certFile, keyFile = makeCertificate(workDir)
+        standIn = QuantastorStandIn()
+        standIn.populate(volumes=0, shares=0, hosts=0, initiators=0)
+        pools = dict((pool['name'], pool) for pool in standIn._objects['pool'].values())
+        server = serve(standIn, certFile, keyFile)
+        try:
+            common = dict(pool='auto', size=options.size, quantastor_hostname='127.0.0.1', quantastor_cert=certFile,
+                          quantastor_state_dir=workDir)
+            executor = ThreadPoolExecutor(max_workers=max(1, options.forks))
+            try:
+                placed = list(executor.map(lambda i: createVolume(workDir, dict(common, volume='placedVol%d' % i)), range(options.count)))
+            finally:
+                executor.shutdown(wait=True)
+        finally:
+            server.shutdown()
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    print("%-8s %-8s %6s %8s" % ('pool', 'system', 'free', 'volumes'))
+    for name, pool in sorted(pools.items()):
+        print("%-8s %-8s %5.0f%% %8d" % (name, pool['storageSystemId'], 100.0 * int(pool['freeSpace']) / int(pool['size']), placed.count(name)))
+    print("placement order: %s" % ' '.join(placed))
+    if options.count > 1 and max(placed.count(name) for name in pools) * 2 > options.count:
+        print("the batch did not spread across the pools", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) 2019, OSNEXUS Engineering (eng@osnexus.com)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Scale and soak test harness for the QuantaStor ansible modules.
+
+Serves a synthetic QuantaStor grid of configurable size from an in-memory REST stand-in on https://127.0.0.1:8153 (the
+port the python SDK always connects to) and runs the quantastor_volume, quantastor_share and quantastor_host modules
+against it through create, no-op, modify and delete cycles at increasing grid sizes. The wall time and number of REST
+calls of every module run are recorded, so scaling cliffs such as per-object probes or quadratic list handling show up
+as curves instead of in production.
+
+The modules are run the way ansible runs them, as separate interpreters, so module_utils/quantastor.py and qs_client.py
+must be installed as described in the README. Generating the self-signed certificate of the stand-in requires openssl.
+
+Examples:
+
+    # measure at 100, 1000 and 10000 objects, print a table and plot the curves (if matplotlib is installed)
+    python tools/qs_scale.py --scales 100,1000,10000 --output scale.json --plot scale.png
+
+    # store a baseline, then fail (exit code 1) when a later run is more than 50% slower or makes more REST calls.
+    # No baseline is shipped: run times depend on the machine, so write your own on the machine doing the comparison.
+    python tools/qs_scale.py --scales 100,1000 --write-baseline scale_baseline.json
+    python tools/qs_scale.py --scales 100,1000 --baseline scale_baseline.json --margin 0.5
+
+    # repeat all cycles 50 times at the largest scale and fail if the last rounds are slower than the first
+    python tools/qs_scale.py --scales 1000 --soak 50
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE_DIR = os.path.join(REPO_DIR, 'quantastor')
+PORT = 8153
+
+
+class QuantastorStandIn(object):
+    """In-memory QuantaStor grid answering the REST calls used by the modules, with per-API call counters"""
+
+    # get api -> (object kind, object parameter, True if the response is wrapped in a task)
+    GETS = {
+        'storageVolumeGet': ('volume', 'storageVolume', False),
+        'networkShareGet': ('share', 'networkShare', True),
+        'hostGet': ('host', 'host', False),
+        'hostGroupGet': ('hostgroup', 'hostGroup', True),
+        'storagePoolGet': ('pool', 'storagePool', False),
+    }
+
+    # enum api -> (object kind, True if the response is wrapped in a task)
+    ENUMS = {
+        'storageVolumeEnum': ('volume', False),
+        'networkShareEnum': ('share', True),
+        'hostEnum': ('host', False),
+        'hostGroupEnum': ('hostgroup', True),
+        'storagePoolEnum': ('pool', False),
+        'qosPolicyEnum': ('qospolicy', False),
+        'userEnum': ('user', True),
+        'userGroupEnum': ('usergroup', True),
+    }
+
+    # networkShareCreateEx parameter -> NetworkShare field kept by the stand-in
+    SHARE_FIELDS = {
+        'description': 'description',
+        'shareOwner': 'ownerUid',
+        'shareOwnerGroup': 'ownerGid',
+        'cifsOptions': 'cifsOptionList',
+        'userAccessList': 'cifsUserAccessList',
+    }
+
+    def __init__(self, latency=0.0):
+        self._latency = latency
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._objects = dict((kind, {}) for kind in ['volume', 'share', 'host', 'hostgroup', 'pool', 'qospolicy', 'user', 'usergroup'])
+        self._names = dict((kind, {}) for kind in self._objects)
+        self._acls = set()
+        self._shareClients = {}
+        self.calls = {}
+
+    def populate(self, volumes, shares, hosts, initiators, pools=4):
+        """Fill the grid with synthetic objects"""
+
+        for i in range(pools):
+            self._add('pool', 'pool%d' % i, size=str(10 ** 15), freeSpace=str(10 ** 15 // (i + 2)), isActive=True,
+                      isDegraded=False, markedDisabled=False, storageSystemId='system%d' % (i % 2))
+        for i in range(volumes):
+            self._add('volume', 'synthVol%d' % i, storagePoolId='pool%d' % (i % pools), size=str(2 ** 30))
+        for i in range(shares):
+            self._add('share', 'synthShare%d' % i, storagePoolId='pool%d' % (i % pools))
+        for i in range(hosts):
+            host = self._add('host', 'synthHost%d' % i)
+            host['initiatorPortList'] = [self._port('iqn.2019-01.com.synth:host%d.%d' % (i, n)) for n in range(initiators)]
+        for i in range(max(1, hosts // 10)):
+            self._add('hostgroup', 'synthGroup%d' % i, hostList=['synthHost%d' % n for n in range(i * 10, min(hosts, i * 10 + 10))])
+        self._add('user', 'admin')
+        self._add('usergroup', 'admins')
+
+    def countCalls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def handle(self, api, params):
+        """Answer one REST call with the JSON the SDK expects"""
+
+        if self._latency:
+            time.sleep(self._latency)
+        with self._lock:
+            self.calls[api] = self.calls.get(api, 0) + 1
+            if api == 'storageSystemGet':
+                return {'id': 'system0', 'name': 'synthSystem'}
+            if api == 'taskGet':
+                return {'id': params.get('id', ''), 'taskState': 5}
+            if api in self.GETS:
+                kind, param, wrapped = self.GETS[api]
+                obj = self._find(kind, params.get(param, ''))
+                if obj is None:
+                    return {'RestError': "Unable to locate %s '%s'." % (kind, params.get(param, ''))}
+                return {'task': self._task(), 'obj': obj} if wrapped else obj
+            if api in self.ENUMS:
+                kind, wrapped = self.ENUMS[api]
+                objects = list(self._objects[kind].values())
+                return {'task': self._task(), 'list': objects} if wrapped else objects
+            handler = getattr(self, '_' + api, None)
+            if handler is None:
+                return {'RestError': "The REST stand-in does not implement '%s'." % api}
+            return handler(params)
+
+    # write handlers, called with the lock held
+
+    def _storageVolumeCreateEx(self, params):
+        if self._find('volume', params['name']):
+            return {'RestError': "A storage volume named '%s' already exists." % params['name']}
+        pool = self._find('pool', params.get('provisionableId', ''))
+        volume = self._add('volume', params['name'], storagePoolId=pool['id'] if pool else '', size=params.get('size', '0'))
+        return self._response(volume)
+
+    def _storageVolumeDelete(self, params):
+        return self._remove('volume', params['storageVolumeList'])
+
+    def _storageVolumeSetQosControls(self, params):
+        volume = self._find('volume', params['storageVolume'])
+        if volume is None:
+            return {'RestError': "Unable to locate storage volume '%s'." % params['storageVolume']}
+        for limit in ['qosReadIops', 'qosWriteIops', 'qosReadBandwidth', 'qosWriteBandwidth']:
+            volume[limit] = params.get(limit, '0')
+        volume['qosPolicyId'] = params.get('qosPolicy', '')
+        self._touch(volume)
+        return self._response(volume)
+
+    def _storageVolumeAclGet(self, params):
+        key = self._aclKey(params['storageVolume'], params['host'])
+        if key not in self._acls:
+            return {'RestError': "No assignment of storage volume '%s' to '%s'." % (params['storageVolume'], params['host'])}
+        return {'storageVolumeId': key[0], 'hostId': key[1]}
+
+    def _storageVolumeAclEnum(self, params):
+        return [{'storageVolumeId': volumeId, 'hostId': hostId} for volumeId, hostId in sorted(self._acls)]
+
+    def _storageVolumeAclAddRemoveEx(self, params):
+        key = self._aclKey(params['storageVolumeList'], params['host'])
+        if params.get('modType', '0') == '0':
+            self._acls.add(key)
+        else:
+            self._acls.discard(key)
+        return {'task': self._task(), 'list': []}
+
+    def _qosPolicyCreate(self, params):
+        return self._response(self._add('qospolicy', params['name'], **self._limits(params)))
+
+    def _qosPolicyModify(self, params):
+        policy = self._find('qospolicy', params['qosPolicy'])
+        policy.update(self._limits(params))
+        return self._response(policy)
+
+    def _networkShareCreateEx(self, params):
+        if self._find('share', params['name']):
+            return {'RestError': "A network share named '%s' already exists." % params['name']}
+        fields = dict((field, params.get(param, '')) for param, field in self.SHARE_FIELDS.items())
+        share = self._add('share', params['name'], storagePoolId=params.get('provisionableId', ''), **fields)
+        if params.get('isPublic') == 'True':
+            self._addShareClient(share, dict(clientFilter='*'))
+        return self._response(share)
+
+    def _networkShareClientEnum(self, params):
+        share = self._find('share', params.get('networkShare', ''))
+        return [shareClient for shareClient in self._shareClients.values() if share is None or shareClient['networkShareId'] == share['id']]
+
+    def _networkShareClientAdd(self, params):
+        share = self._find('share', params['networkShareId'])
+        if share is None:
+            return {'RestError': "Unable to locate share '%s'." % params['networkShareId']}
+        self._addShareClient(share, params)
+        return self._response(share)
+
+    def _networkShareDeleteEx(self, params):
+        return self._remove('share', params['networkShareList'])
+
+    def _hostAdd(self, params):
+        if self._find('host', params['hostname']):
+            return {'RestError': "A host named '%s' already exists." % params['hostname']}
+        host = self._add('host', params['hostname'])
+        host['initiatorPortList'] = [self._port(params['iqn'])] if params.get('iqn') else []
+        return self._response(host)
+
+    def _hostInitiatorAdd(self, params):
+        host = self._find('host', params['host'])
+        if any(port['name'] == params['iqn'] for port in host['initiatorPortList']):
+            return {'RestError': "The initiator '%s' is already assigned." % params['iqn']}
+        host['initiatorPortList'].append(self._port(params['iqn']))
+        self._touch(host)
+        return self._response(host)
+
+    def _hostInitiatorRemove(self, params):
+        host = self._find('host', params['host'])
+        host['initiatorPortList'] = [port for port in host['initiatorPortList'] if port['name'] != params['iqn']]
+        self._touch(host)
+        return self._response(host)
+
+    def _hostRemove(self, params):
+        return self._remove('host', params['host'])
+
+    def _hostGroupCreate(self, params):
+        return self._response(self._add('hostgroup', params['name'], hostList=params.get('hostList', '').split(',')))
+
+    def _hostGroupDelete(self, params):
+        return self._remove('hostgroup', params['hostGroup'])
+
+    # helpers
+
+    def _add(self, kind, name, **fields):
+        obj = dict(id=str(uuid.uuid4()), name=name, **fields)
+        self._touch(obj)
+        self._objects[kind][obj['id']] = obj
+        self._names[kind][name] = obj['id']
+        return obj
+
+    def _find(self, kind, key):
+        return self._objects[kind].get(self._names[kind].get(key, key))
+
+    def _remove(self, kind, key):
+        obj = self._find(kind, key)
+        if obj is None:
+            return {'RestError': "Unable to locate %s '%s'." % (kind, key)}
+        del self._objects[kind][obj['id']]
+        del self._names[kind][obj['name']]
+        return {'task': self._task(), 'obj': obj, 'list': [obj]}
+
+    def _addShareClient(self, share, params):
+        shareClient = dict(id=str(uuid.uuid4()), networkShareId=share['id'], clientFilter=params['clientFilter'],
+                           readOnly=params.get('readOnly') == 'True', secure=params.get('secure') == 'True',
+                           subtreeCheck=params.get('subtreeCheck') == 'True', customOptions=params.get('customOptions', ''))
+        shareClient['async'] = params.get('isAsync') == 'True'
+        self._shareClients[shareClient['id']] = shareClient
+        self._touch(share)
+
+    def _aclKey(self, volume, host):
+        volume = self._find('volume', volume)
+        host = self._find('host', host) or self._find('hostgroup', host)
+        return (volume['id'] if volume else volume, host['id'] if host else host)
+
+    def _touch(self, obj):
+        obj['modifiedTimeStamp'] = '%.6f' % time.time()
+
+    def _port(self, iqn):
+        return {'id': str(uuid.uuid4()), 'name': iqn, 'iqn': iqn}
+
+    def _limits(self, params):
+        return dict((limit, params.get(limit, '0')) for limit in ['qosReadIops', 'qosWriteIops', 'qosReadBandwidth', 'qosWriteBandwidth'])
+
+    def _task(self):
+        return {'id': str(uuid.uuid4()), 'taskState': 5}
+
+    def _response(self, obj):
+        return {'task': self._task(), 'obj': obj, 'list': [obj]}
+
+
+def serve(standIn, certFile, keyFile):
+    """Start the HTTPS server of the stand-in in a background thread and return it"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            api = url.path.rsplit('/', 1)[-1]
+            params = dict((key, values[-1]) for key, values in parse_qs(url.query, keep_blank_values=True).items())
+            body = json.dumps(standIn.handle(api, params)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', PORT), Handler)
+    server.daemon_threads = True
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certFile, keyFile)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def makeCertificate(directory):
+    certFile = os.path.join(directory, 'standin.crt')
+    keyFile = os.path.join(directory, 'standin.key')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2', '-subj', '/CN=127.0.0.1',
+                           '-addext', 'subjectAltName=IP:127.0.0.1', '-keyout', keyFile, '-out', certFile],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certFile, keyFile
+
+
+def cycles(scale, initiators, bulk):
+    """Return the (module, cycle, arguments) module runs of one round at the given scale"""
+
+    hostInitiators = ['iqn.2019-01.com.synth:scalehost.%d' % n for n in range(initiators)]
+    bulkVolumes = ['synthVol%d' % i for i in range(min(bulk, scale))]
+    return [
+        ('volume', 'create', dict(volume='scaleVol', pool='pool0', size='10GB')),
+        ('volume', 'noop', dict(volume='scaleVol', pool='pool0', size='10GB')),
+        ('volume', 'modify', dict(volume='scaleVol', qosReadIops='1000')),
+        ('volume', 'bulk-modify', dict(volumes=bulkVolumes, qosWriteIops='500')),
+        ('volume', 'delete', dict(volume='scaleVol', state='absent')),
+        ('share', 'create', dict(share='scaleShare', pool='pool1', quota='100GB')),
+        ('share', 'noop', dict(share='scaleShare', pool='pool1', quota='100GB')),
+        ('share', 'delete', dict(share='scaleShare', state='absent')),
+        ('host', 'create', dict(host='scaleHost', initiators=hostInitiators)),
+        ('host', 'noop', dict(host='scaleHost', initiators=hostInitiators)),
+        ('host', 'modify', dict(host='scaleHost', initiators=hostInitiators + ['iqn.2019-01.com.synth:scalehost.extra'])),
+        ('host', 'delete', dict(host='scaleHost', state='absent')),
+    ]
+
+
+def runModule(standIn, module, args, common, workDir):
+    """Run one module in its own interpreter and return (seconds, REST calls, result)"""
+
+    argsFile = os.path.join(workDir, 'args.json')
+    with open(argsFile, 'w') as f:
+        json.dump({'ANSIBLE_MODULE_ARGS': dict(common, **args)}, f)
+    before = standIn.countCalls()
+    start = time.time()
+    process = subprocess.run([sys.executable, os.path.join(MODULE_DIR, 'quantastor_%s.py' % module), argsFile],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    seconds = time.time() - start
+    calls = standIn.countCalls() - before
+    result = None
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith('{'):
+            result = json.loads(line)
+            break
+    if result is None or result.get('failed'):
+        raise Exception("quantastor_%s %s failed: %s" % (module, json.dumps(args)[:200], (result or {}).get('msg') or process.stderr[-2000:]))
+    return seconds, calls, result
+
+
+def runRound(standIn, scale, options, common, workDir):
+    """Run all cycles once and return {module/cycle: (seconds, calls)}"""
+
+    measurements = {}
+    for module, cycle, args in cycles(scale, max(1, int(scale * options.initiator_ratio)), options.bulk):
+        seconds, calls, result = runModule(standIn, module, args, common, workDir)
+        measurements['%s/%s' % (module, cycle)] = (seconds, calls)
+    return measurements
+
+
+def measure(options, standIn, certFile, workDir):
+    """Measure every cycle at every scale; returns {module/cycle: [{scale, seconds, calls}]}"""
+
+    results = {}
+    for scale in options.scales:
+        standIn.reset()
+        standIn.populate(volumes=scale, shares=scale, hosts=max(1, scale // 10), initiators=max(1, int(scale * options.initiator_ratio)))
+        stateDir = tempfile.mkdtemp(dir=workDir)
+        common = dict(quantastor_hostname='127.0.0.1', quantastor_cert=certFile, quantastor_state_dir=stateDir, **options.extra)
+        rounds = [runRound(standIn, scale, options, common, workDir) for i in range(options.repeat)]
+        for key in rounds[0]:
+            results.setdefault(key, []).append({
+                'scale': scale,
+                'seconds': round(statistics.median(r[key][0] for r in rounds), 4),
+                'calls': max(r[key][1] for r in rounds),
+            })
+        print("scale %d done" % scale, file=sys.stderr)
+    return results
+
+
+def soak(options, standIn, certFile, workDir):
+    """Repeat all cycles at the largest scale and return the total seconds of every round"""
+
+    scale = max(options.scales)
+    standIn.reset()
+    standIn.populate(volumes=scale, shares=scale, hosts=max(1, scale // 10), initiators=max(1, int(scale * options.initiator_ratio)))
+    common = dict(quantastor_hostname='127.0.0.1', quantastor_cert=certFile, quantastor_state_dir=tempfile.mkdtemp(dir=workDir), **options.extra)
+    totals = []
+    for i in range(options.soak):
+        totals.append(round(sum(seconds for seconds, calls in runRound(standIn, scale, options, common, workDir).values()), 4))
+    return totals
+
+
+def compare(results, soakTotals, baseline, margin, callsMargin):
+    """Return the list of measurements exceeding the baseline by more than the margins"""
+
+    regressions = []
+    for key, points in sorted(results.items()):
+        for point in points:
+            base = baseline.get('results', {}).get('%s/%d' % (key, point['scale']))
+            if base is None:
+                print("no baseline for %s at scale %d" % (key, point['scale']), file=sys.stderr)
+                continue
+            if point['seconds'] > base['seconds'] * (1 + margin):
+                regressions.append("%s at scale %d took %.3fs, baseline %.3fs" % (key, point['scale'], point['seconds'], base['seconds']))
+            if point['calls'] > base['calls'] * (1 + callsMargin):
+                regressions.append("%s at scale %d made %d REST calls, baseline %d" % (key, point['scale'], point['calls'], base['calls']))
+    if len(soakTotals) >= 4:
+        quarter = len(soakTotals) // 4
+        first = statistics.mean(soakTotals[:quarter])
+        last = statistics.mean(soakTotals[-quarter:])
+        if last > first * (1 + margin):
+            regressions.append("soak rounds slowed down from %.3fs to %.3fs" % (first, last))
+    return regressions
+
+
+def printTable(results):
+    print("%-22s %8s %10s %8s" % ('module/cycle', 'scale', 'seconds', 'calls'))
+    for key, points in sorted(results.items()):
+        for point in points:
+            print("%-22s %8d %10.3f %8d" % (key, point['scale'], point['seconds'], point['calls']))
+
+
+def plot(results, path):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib is not installed, skipping the plot", file=sys.stderr)
+        return
+    figure, (latency, calls) = plt.subplots(1, 2, figsize=(14, 6))
+    for key, points in sorted(results.items()):
+        scales = [p['scale'] for p in points]
+        latency.plot(scales, [p['seconds'] for p in points], marker='o', label=key)
+        calls.plot(scales, [p['calls'] for p in points], marker='o', label=key)
+    for axis, label in [(latency, 'seconds per module run'), (calls, 'REST calls per module run')]:
+        axis.set_xscale('log')
+        axis.set_xlabel('objects in grid')
+        axis.set_ylabel(label)
+        axis.grid(True)
+    calls.legend(fontsize='small')
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', default='100,1000,10000', help='comma separated grid sizes (volumes and shares; hosts are a tenth)')
+    parser.add_argument('--initiator-ratio', type=float, default=0.1, help='initiators per synthetic host as a fraction of the scale')
+    parser.add_argument('--bulk', type=int, default=100, help='number of volumes in the bulk QoS cycle')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the median time is reported')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stand-in waits before answering each call')
+    parser.add_argument('--extra', action='append', default=[], help='extra module argument as key=value (eg. quantastor_journal=true)')
+    parser.add_argument('--soak', type=int, default=0, help='repeat all cycles this many times at the largest scale')
+    parser.add_argument('--output', help='write the measurements to this JSON file')
+    parser.add_argument('--plot', help='plot the scaling curves to this image file (requires matplotlib)')
+    parser.add_argument('--baseline', help='fail if a measurement exceeds this baseline JSON file by more than the margins')
+    parser.add_argument('--write-baseline', help='write the measurements as a baseline JSON file')
+    parser.add_argument('--margin', type=float, default=0.5, help='allowed fractional increase of the run time over the baseline')
+    parser.add_argument('--calls-margin', type=float, default=0.0, help='allowed fractional increase of the REST calls over the baseline')
+    options = parser.parse_args()
+    options.scales = [int(scale) for scale in options.scales.split(',')]
+    options.extra = dict(item.split('=', 1) for item in options.extra)
+    for key, value in options.extra.items():
+        if value.lower() in ['true', 'false']:
+            options.extra[key] = value.lower() == 'true'
+
+    workDir = tempfile.mkdtemp(prefix='qs_scale')
+    try:
+        certFile, keyFile = makeCertificate(workDir)
+        standIn = QuantastorStandIn(latency=options.latency)
+        server = serve(standIn, certFile, keyFile)
+        try:
+            results = measure(options, standIn, certFile, workDir)
+            soakTotals = soak(options, standIn, certFile, workDir) if options.soak else []
+        finally:
+            server.shutdown()
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    printTable(results)
+    if soakTotals:
+        print("soak round seconds: %s" % ' '.join('%.3f' % total for total in soakTotals))
+    report = {'results': dict(('%s/%d' % (key, p['scale']), p) for key, points in results.items() for p in points), 'soak': soakTotals}
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if options.write_baseline:
+        with open(options.write_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if options.plot:
+        plot(results, options.plot)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, soakTotals, baseline, options.margin, options.calls_margin)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# (c) 2019, OSNEXUS Engineering (eng@osnexus.com)
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Startup benchmark for the QuantaStor ansible modules.
+
+Measures for every module the time from starting its interpreter until its first REST request reaches the local REST
+stand-in of tools/qs_scale.py, and the total run time of a no-op run. For runs that change nothing interpreter startup and
+imports are most of the task time, so this is the number to watch when touching module imports.
+
+With '--cold' every run gets an empty bytecode cache, which is how ansible runs modules (from a zip file, so module_utils
+and qs_client.py are compiled again by every task). '--imports N' prints the N slowest imports of each module.
+
+Examples:
+
+    python tools/qs_startup.py
+    python tools/qs_startup.py --cold --repeat 10 --imports 10
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from qs_scale import MODULE_DIR, QuantastorStandIn, makeCertificate, serve
+
+# module -> arguments of a no-op run against the synthetic grid
+MODULE_ARGS = {
+    'volume': dict(volume='synthVol0', pool='pool0', size='1GB'),
+    'share': dict(share='synthShare0', pool='pool0'),
+    'host': dict(host='synthHost0', initiators=['iqn.2019-01.com.synth:host0.0']),
+}
+
+
+class TimingStandIn(QuantastorStandIn):
+    """REST stand-in remembering when the first request after arm() arrived"""
+
+    def arm(self):
+        self.firstCall = None
+
+    def handle(self, api, params):
+        if getattr(self, 'firstCall', 0) is None:
+            self.firstCall = time.time()
+        return QuantastorStandIn.handle(self, api, params)
+
+
+def runModule(standIn, module, args, workDir, cold, importTime):
+    """Run one module and return (seconds to first request, total seconds, stderr)"""
+
+    argsFile = os.path.join(workDir, 'args.json')
+    with open(argsFile, 'w') as f:
+        json.dump({'ANSIBLE_MODULE_ARGS': args}, f)
+    env = dict(os.environ)
+    if cold:
+        env['PYTHONPYCACHEPREFIX'] = tempfile.mkdtemp(dir=workDir)
+    command = [sys.executable] + (['-X', 'importtime'] if importTime else []) + [os.path.join(MODULE_DIR, 'quantastor_%s.py' % module), argsFile]
+    standIn.arm()
+    start = time.time()
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, env=env)
+    total = time.time() - start
+    if standIn.firstCall is None:
+        raise Exception("quantastor_%s made no REST request: %s" % (module, (process.stdout + process.stderr)[-2000:]))
+    return standIn.firstCall - start, total, process.stderr
+
+
+def slowestImports(stderr, count):
+    """Return the 'count' top-level imports with the highest cumulative time from -X importtime output"""
+
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modules', default=','.join(sorted(MODULE_ARGS)), help='comma separated modules to measure')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per module, the median is reported')
+    parser.add_argument('--cold', action='store_true', help='run every module with an empty bytecode cache like ansible does')
+    parser.add_argument('--imports', type=int, default=0, help='print the N slowest top-level imports of each module')
+    parser.add_argument('--output', help='write the measurements to this JSON file')
+    options = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix='qs_startup')
+    results = {}
+    try:
+        certFile, keyFile = makeCertificate(workDir)
+        standIn = TimingStandIn()
+        standIn.populate(volumes=10, shares=10, hosts=10, initiators=1)
+        server = serve(standIn, certFile, keyFile)
+        try:
+            for module in options.modules.split(','):
+                args = dict(MODULE_ARGS[module], quantastor_hostname='127.0.0.1', quantastor_cert=certFile,
+                            quantastor_state_dir=tempfile.mkdtemp(dir=workDir))
+                runs = [runModule(standIn, module, args, workDir, options.cold, False) for i in range(options.repeat)]
+                results[module] = {
+                    'firstRequest': round(statistics.median(run[0] for run in runs), 4),
+                    'total': round(statistics.median(run[1] for run in runs), 4),
+                }
+                if options.imports:
+                    results[module]['imports'] = slowestImports(runModule(standIn, module, args, workDir, options.cold, True)[2], options.imports)
+        finally:
+            server.shutdown()
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    print("%-10s %14s %10s" % ('module', 'first request', 'total'))
+    for module, result in sorted(results.items()):
+        print("%-10s %13.3fs %9.3fs" % (module, result['firstRequest'], result['total']))
+        for cumulative, name in result.get('imports', []):
+            print("    %8.1fms  %s" % (cumulative / 1000.0, name))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()